@@ -0,0 +1,184 @@
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import psycopg2
+from botocore.exceptions import BotoCoreError, ClientError
+from PIL import Image
+from psycopg2.extras import execute_values
+
+import metrics
+from images import get_b2_client, image_bucket_name, put_object, IMAGE_WORKERS
+
+ATLASES_ENABLED = os.environ.get("ATLASES_ENABLED", "true").lower() == "true"
+ATLAS_PADDING = 1  # Pixels between sprites, avoids bleeding when the client scales the atlas
+
+
+def _atlas_digest(items: list) -> str:
+    return hashlib.sha256(json.dumps(items, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def _fetch_sprite(image_url: str):
+    key = urlparse(image_url).path.lstrip("/")
+    try:
+        response = get_b2_client().get_object(Bucket=image_bucket_name, Key=key)
+        return Image.open(io.BytesIO(response["Body"].read())).convert("RGBA")
+    except (ClientError, BotoCoreError, OSError) as e:
+        logging.error(f"Could not fetch sprite {key} for an atlas: {e}")
+        return None
+
+
+def pack_sprites(sprites: dict):
+    """
+    Shelf-packs sprites into one image. Returns (atlas, {item_id: [x, y, width, height]}).
+    Sprites are placed tallest first, in rows no wider than roughly the square root of the total area.
+    """
+    total_area = sum((sprite.width + ATLAS_PADDING) * (sprite.height + ATLAS_PADDING) for sprite in sprites.values())
+    max_sprite_width = max(sprite.width for sprite in sprites.values()) + ATLAS_PADDING
+    row_width = max(max_sprite_width, math.ceil(math.sqrt(total_area)))
+
+    positions = {}
+    x = y = row_height = atlas_width = 0
+    for item_id, sprite in sorted(sprites.items(), key=lambda entry: (-entry[1].height, entry[0])):
+        if x + sprite.width > row_width:
+            x = 0
+            y += row_height + ATLAS_PADDING
+            row_height = 0
+        positions[item_id] = [x, y, sprite.width, sprite.height]
+        x += sprite.width + ATLAS_PADDING
+        row_height = max(row_height, sprite.height)
+        atlas_width = max(atlas_width, x - ATLAS_PADDING)
+
+    atlas = Image.new("RGBA", (atlas_width, y + row_height), (0, 0, 0, 0))
+    for item_id, (left, top, _, _) in positions.items():
+        atlas.paste(sprites[item_id], (left, top))
+    return atlas, positions
+
+
+def _build_atlas(subcategory_id: int, digest: str, item_urls: list, sprites: dict):
+    atlas_sprites = {item_id: sprites[url] for item_id, url in item_urls}
+    atlas, positions = pack_sprites(atlas_sprites)
+
+    png = io.BytesIO()
+    atlas.save(png, format="PNG", optimize=True)
+    webp = io.BytesIO()
+    atlas.save(webp, format="WEBP", lossless=True, quality=100, method=6)
+
+    # Content addressed keys, so clients can cache them forever
+    base_key = f"atlases/{subcategory_id}-{digest[:16]}"
+    cache_control = "public, max-age=31536000, immutable"
+    png_url = put_object(png.getvalue(), f"{base_key}.png", "image/png", cache_control)
+    webp_url = put_object(webp.getvalue(), f"{base_key}.webp", "image/webp", cache_control)
+    if not png_url or not webp_url:
+        return None
+
+    atlas_map = {
+        "width": atlas.width,
+        "height": atlas.height,
+        "sprites": {str(item_id): position for item_id, position in positions.items()}
+    }
+    map_url = put_object(json.dumps(atlas_map, separators=(",", ":")).encode("utf-8"), f"{base_key}.json",
+                         "application/json", cache_control)
+    # Without its map the atlas is unusable, leave the digest unsaved so the next run tries again
+    if not map_url:
+        return None
+    return subcategory_id, png_url, webp_url, json.dumps(atlas_map), map_url, digest
+
+
+def update_atlases(conn, built_atlases: dict = None) -> int:
+    """
+    Builds a sprite atlas for every subcategory whose items or image URLs changed since its last atlas.
+    Subcategories with items still missing an image are skipped until the images are resolved.
+    built_atlases maps (subcategory id, digest) to atlases already built this run, so that several
+    target databases share them instead of building and uploading each one again.
+    """
+    if not ATLASES_ENABLED:
+        return 0
+    if built_atlases is None:
+        built_atlases = {}
+
+    sql_items = """
+                SELECT s.id, s.atlas_digest, si.originalitemid, si.image_url
+                FROM subcategories s
+                         JOIN subcategory_items si ON si.subcategoryid = s.id
+                ORDER BY s.id, si.displayorder, si.id;
+                """
+
+    update_sql = """
+                 UPDATE subcategories
+                 SET atlas_png_url  = v.atlas_png_url,
+                     atlas_webp_url = v.atlas_webp_url,
+                     atlas_map      = v.atlas_map::jsonb,
+                     atlas_map_url  = v.atlas_map_url,
+                     atlas_digest   = v.atlas_digest
+                 FROM (VALUES %s) AS v(id, atlas_png_url, atlas_webp_url, atlas_map, atlas_map_url, atlas_digest)
+                 WHERE subcategories.id = v.id;
+                 """
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql_items)
+            rows = cur.fetchall()
+        # Don't hold a transaction open while the atlases are built
+        conn.rollback()
+    except psycopg2.Error as e:
+        logging.error(f"Database error while reading subcategories for atlases: {e}")
+        conn.rollback()
+        return 0
+
+    subcategories = {}
+    for subcategory_id, atlas_digest, item_id, image_url in rows:
+        entry = subcategories.setdefault(subcategory_id, {"atlas_digest": atlas_digest, "items": []})
+        entry["items"].append([item_id, image_url or None])
+
+    to_build = []
+    built = []
+    for subcategory_id, entry in subcategories.items():
+        digest = _atlas_digest(entry["items"])
+        if digest == entry["atlas_digest"]:
+            continue
+        if any(image_url is None for _, image_url in entry["items"]):
+            logging.debug(f"Not building an atlas for subcategory {subcategory_id}, it has items without images")
+            continue
+        if (subcategory_id, digest) in built_atlases:
+            built.append(built_atlases[(subcategory_id, digest)])
+            continue
+        # An item can appear twice with the same sprite, it only needs one slot
+        item_urls = list(dict(entry["items"]).items())
+        to_build.append((subcategory_id, digest, item_urls))
+
+    urls = sorted({url for _, _, item_urls in to_build for _, url in item_urls})
+    if to_build:
+        logging.info(f"Building {len(to_build)} sprite atlases from {len(urls)} sprites")
+    with ThreadPoolExecutor(max_workers=IMAGE_WORKERS) as executor:
+        sprites = dict(zip(urls, executor.map(_fetch_sprite, urls)))
+
+    for subcategory_id, digest, item_urls in to_build:
+        if any(sprites[url] is None for _, url in item_urls):
+            logging.warning(f"Skipping the atlas for subcategory {subcategory_id}, some sprites could not be fetched")
+            continue
+        with metrics.timed("atlas_build"):
+            result = _build_atlas(subcategory_id, digest, item_urls, sprites)
+        if result:
+            built_atlases[(subcategory_id, digest)] = result
+            built.append(result)
+
+    if not built:
+        return 0
+
+    try:
+        with conn.cursor() as cur:
+            execute_values(cur, update_sql, built, page_size=len(built))
+        conn.commit()
+    except psycopg2.Error as e:
+        logging.error(f"Database error while saving sprite atlases: {e}")
+        conn.rollback()
+        return 0
+
+    metrics.incr("atlases_built", len(built))
+    return len(built)
@@ -0,0 +1,149 @@
+"""
+Reprocesses the sprites already in the bucket: recompresses each items/{id}.png losslessly, uploads the
+WebP variants and records their URLs on subcategory_items in every target database. Safe to re-run, only
+items missing a variant URL in some target are processed unless --force is given, and variants already in
+the bucket are only recorded.
+
+    python backfill_images.py --workers 16
+"""
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from botocore.exceptions import BotoCoreError, ClientError
+from psycopg2.extras import execute_values
+
+import metrics
+from db import connect_db, get_db_targets, release_db, target_name
+from image_variants import IMAGE_WEBP_2X, encode_variants, variant_key
+from images import IMAGE_WORKERS, existing_variant_urls, get_b2_client, image_bucket_name, list_existing_images, \
+    upload_sprite
+
+
+def reprocess_sprite(item_id, include_2x: bool):
+    """Returns (item_id, {variant: url}) for the variants uploaded, or None if the sprite couldn't be processed."""
+    try:
+        response = get_b2_client().get_object(Bucket=image_bucket_name, Key=variant_key(item_id, "png"))
+        data = response["Body"].read()
+    except (ClientError, BotoCoreError) as e:
+        logging.error(f"Could not fetch the sprite for item {item_id}: {e}")
+        return None
+
+    variants = encode_variants(data, include_2x)
+    if variants["png"] is data:
+        # Already as small as it gets, no need to rewrite it
+        del variants["png"]
+    if "webp" not in variants:
+        return None
+    return item_id, upload_sprite(item_id, data, variants)
+
+
+def find_items_missing_variants(dsn: str = None, include_2x: bool = IMAGE_WEBP_2X):
+    """Items with a sprite but no WebP URL (or 2x URL, with include_2x) in a target. None on a database error."""
+    sql = """
+          SELECT DISTINCT originalitemid
+          FROM subcategory_items
+          WHERE image_url IS NOT NULL
+            AND image_url != ''
+            AND (image_webp_url IS NULL OR (%s AND image_webp_2x_url IS NULL));
+          """
+    conn = connect_db(dsn)
+    if not conn:
+        logging.error(f"Could not connect to {target_name(dsn)} to find items missing image variants")
+        return None
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, (include_2x,))
+            return {row[0] for row in cur.fetchall()}
+    except psycopg2.Error as e:
+        logging.error(f"Database error while finding items missing image variants in {target_name(dsn)}: {e}")
+        conn.rollback()
+        return None
+    finally:
+        release_db(conn)
+
+
+def save_variant_urls(results: list, dsn: str = None) -> int:
+    update_sql = """
+                 UPDATE subcategory_items
+                 SET image_webp_url    = COALESCE(v.image_webp_url, subcategory_items.image_webp_url),
+                     image_webp_2x_url = COALESCE(v.image_webp_2x_url, subcategory_items.image_webp_2x_url)
+                 FROM (VALUES %s) AS v(originalitemid, image_webp_url, image_webp_2x_url)
+                 WHERE subcategory_items.originalitemid = v.originalitemid
+                   AND (subcategory_items.image_webp_url, subcategory_items.image_webp_2x_url)
+                     IS DISTINCT FROM (COALESCE(v.image_webp_url, subcategory_items.image_webp_url),
+                                       COALESCE(v.image_webp_2x_url, subcategory_items.image_webp_2x_url));
+                 """
+    rows = [(item_id, urls.get("webp"), urls.get("webp_2x")) for item_id, urls in results if urls]
+    if not rows:
+        return 0
+
+    conn = connect_db(dsn)
+    if not conn:
+        logging.error(f"Could not connect to {target_name(dsn)}, variant URLs were not saved there")
+        return 0
+    try:
+        with conn.cursor() as cur:
+            execute_values(cur, update_sql, rows, page_size=len(rows))
+            updated = cur.rowcount
+        conn.commit()
+        return updated
+    except psycopg2.Error as e:
+        logging.error(f"Database error while saving image variant URLs to {target_name(dsn)}: {e}")
+        conn.rollback()
+        return 0
+    finally:
+        release_db(conn)
+
+
+def backfill(workers: int = IMAGE_WORKERS, force: bool = False, include_2x: bool = IMAGE_WEBP_2X) -> int:
+    existing_images = list_existing_images()
+    if existing_images is None:
+        return 0
+
+    targets = get_db_targets()
+    wanted = ["webp", "webp_2x"] if include_2x else ["webp"]
+    item_ids = sorted(int(name[:-len(".png")]) for name in existing_images
+                      if name.endswith(".png") and name[:-len(".png")].isdigit())
+    uploaded = []
+    if not force:
+        # What the databases lack, not what the bucket lacks: an upload whose URLs were never saved still counts
+        missing = set()
+        for dsn in targets:
+            missing |= find_items_missing_variants(dsn, include_2x) or set()
+        item_ids = [item_id for item_id in item_ids if item_id in missing]
+        uploaded = [(item_id, existing_variant_urls(item_id, existing_images)) for item_id in item_ids
+                    if all(variant_key(item_id, variant)[len("items/"):] in existing_images for variant in wanted)]
+        already_uploaded = {item_id for item_id, _ in uploaded}
+        item_ids = [item_id for item_id in item_ids if item_id not in already_uploaded]
+    logging.info(f"Reprocessing {len(item_ids)} sprites with {workers} workers, "
+                 f"recording {len(uploaded)} already uploaded")
+
+    # Each worker fetches its own sprite, so only `workers` sprites are held in memory at once
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = [result for result in executor.map(lambda item_id: reprocess_sprite(item_id, include_2x), item_ids)
+                   if result]
+
+    updated = sum(save_variant_urls(uploaded + results, dsn) for dsn in targets)
+    logging.info(f"Reprocessed {len(results)} of {len(item_ids)} sprites, updated {updated} subcategory rows "
+                 f"in {len(targets)} databases")
+    return len(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompress the sprites in B2 and add their WebP variants.")
+    parser.add_argument("--workers", type=int, default=IMAGE_WORKERS, help="Sprites processed at once")
+    parser.add_argument("--force", action="store_true", help="Reprocess sprites that already have every variant")
+    parser.add_argument("--2x", dest="include_2x", action="store_true", default=IMAGE_WEBP_2X,
+                        help="Also produce 2x WebP variants for hi-DPI screens")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    success = False
+    try:
+        with metrics.stage("backfill_images"):
+            backfill(args.workers, args.force, args.include_2x)
+        success = True
+    finally:
+        metrics.export(success)
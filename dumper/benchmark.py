@@ -0,0 +1,276 @@
+"""
+Benchmarks the dumper pipeline against a synthetic osrs-cache archive.
+
+Everything except the database runs locally: RuneLite item names, weirdgloop sprites and the B2 bucket
+are served by an in-process stand-in HTTP server. The database is whatever DB_* points at. It must be a
+throwaway database with the server migrations applied, because its catalogue tables are truncated
+(with --reset) before every repetition.
+
+    DB_HOST=localhost DB_NAME=clogged_bench python benchmark.py --subcategories 40 --items 50 --reset
+"""
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import struct
+import tarfile
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+from xml.sax.saxutils import escape
+
+CATEGORY_ENUM_IDS = [2103, 2104, 2105, 2106, 2107]
+BENCH_BUCKET = "bench-bucket"
+
+
+def make_png(width: int = 32, height: int = 32) -> bytes:
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    raw = b"".join(b"\x00" + bytes(random.randrange(256) for _ in range(width * 4)) for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw))
+            + chunk(b"IEND", b""))
+
+
+def build_synthetic_cache(path: str, subcategories: int, items: int, noise: int, seed: int = 1):
+    """
+    Writes a .tar.gz laid out like an osrs-cache release: every category enum points at `subcategories`
+    structs, each with an items enum of `items` item ids, plus `noise` unrelated enums and structs.
+    Returns the set of item ids used.
+    """
+    rng = random.Random(seed)
+    files = {}
+    item_ids = set()
+    struct_id = 5000
+    items_enum_id = 10000
+
+    for category_enum_id in CATEGORY_ENUM_IDS:
+        struct_ids = []
+        for _ in range(subcategories):
+            enum_items = rng.sample(range(1, 30000), items)
+            item_ids.update(enum_items)
+            files[f"dump/enums/{items_enum_id}.json"] = {"id": items_enum_id, "keys": list(range(items)), "intVals": enum_items}
+            files[f"dump/structs/{struct_id}.json"] = {"id": struct_id, "params": {"689": f"Subcategory {struct_id}", "690": items_enum_id}}
+            struct_ids.append(struct_id)
+            struct_id += 1
+            items_enum_id += 1
+        files[f"dump/enums/{category_enum_id}.json"] = {"id": category_enum_id, "keys": list(range(len(struct_ids))), "intVals": struct_ids}
+
+    files["dump/enums/3721.json"] = {"id": 3721, "keys": [], "intVals": []}
+    for offset in range(noise):
+        files[f"dump/enums/{50000 + offset}.json"] = {"id": 50000 + offset, "keys": [0], "intVals": [offset]}
+        files[f"dump/structs/{50000 + offset}.json"] = {"id": 50000 + offset, "params": {"1": offset}}
+
+    names = list(files)
+    rng.shuffle(names)
+    with tarfile.open(path, "w:gz") as tar:
+        for name in names:
+            data = json.dumps(files[name]).encode("utf-8")
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    return item_ids
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves /names.json, /sprites/<id>.png and a minimal S3 API (ListObjectsV2, GetObject, PutObject, HeadObject)."""
+    # HTTP/1.1 answers boto3's "Expect: 100-continue" and keeps connections alive, like the real endpoints.
+    # Under HTTP/1.0 every PutObject waits out the client's continue timeout before sending its body.
+    protocol_version = "HTTP/1.1"
+    names = b"{}"
+    sprite = b""
+    objects = {}
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b"", content_type="application/octet-stream", headers=None):
+        # Every response sets Content-Length, keep-alive depends on it
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _object_key(self, path):
+        return unquote(path[len(f"/{BENCH_BUCKET}/"):])
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/names.json":
+            self._send(200, self.names, "application/json", {"ETag": '"bench"'})
+        elif url.path.startswith("/sprites/"):
+            self._send(200, self.sprite, "image/png")
+        elif url.path.rstrip("/") == f"/{BENCH_BUCKET}":
+            prefix = parse_qs(url.query).get("prefix", [""])[0]
+            with self.lock:
+                keys = sorted(key for key in self.objects if key.startswith(prefix))
+            contents = "".join(f"<Contents><Key>{escape(key)}</Key><Size>{len(self.objects[key])}</Size></Contents>" for key in keys)
+            body = ('<?xml version="1.0" encoding="UTF-8"?>'
+                    '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                    f"<Name>{BENCH_BUCKET}</Name><Prefix>{escape(prefix)}</Prefix><KeyCount>{len(keys)}</KeyCount>"
+                    f"<MaxKeys>{len(keys) or 1000}</MaxKeys><IsTruncated>false</IsTruncated>{contents}</ListBucketResult>")
+            self._send(200, body.encode("utf-8"), "application/xml")
+        elif url.path.startswith(f"/{BENCH_BUCKET}/"):
+            with self.lock:
+                body = self.objects.get(self._object_key(url.path))
+            self._send(200, body) if body is not None else self._send(404)
+        else:
+            self._send(404)
+
+    def do_HEAD(self):
+        with self.lock:
+            exists = self._object_key(urlparse(self.path).path) in self.objects
+        self._send(200 if exists else 404)
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.lock:
+            self.objects[self._object_key(urlparse(self.path).path)] = body
+        self._send(200, headers={"ETag": '"stand-in"'})
+
+
+def start_stand_in(item_ids) -> ThreadingHTTPServer:
+    StandInHandler.names = json.dumps({str(item_id): f"Item {item_id}" for item_id in item_ids}).encode("utf-8")
+    StandInHandler.sprite = make_png()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def configure_environment(base_url: str, cache_dir: str):
+    """Points every network dependency of the dumper at the stand-in. Must run before the dumper modules are imported."""
+    os.environ["DUMPER_CACHE_DIR"] = cache_dir
+    os.environ["ITEM_NAMES_URL"] = f"{base_url}/names.json"
+    os.environ["SPRITE_BASE_URL"] = f"{base_url}/sprites"
+    os.environ["B2_ENDPOINT_URL"] = base_url
+    os.environ["B2_ENDPOINT"] = urlparse(base_url).netloc
+    os.environ["B2_ADDRESSING_STYLE"] = "path"
+    os.environ["B2_IMAGES_BUCKET_NAME"] = BENCH_BUCKET
+    os.environ.setdefault("B2_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("B2_SECRET_ACCESS_KEY", "bench")
+    os.environ.setdefault("IMAGE_HOST_RATE_LIMIT", "0")
+
+
+def mutate_dump(data_dump: list, fraction: float, seed: int = 2) -> list:
+    """Returns a copy of the dump where `fraction` of the subcategories gain, lose and reorder items."""
+    from dump import CatalogueItem
+
+    rng = random.Random(seed)
+    mutated = []
+    for subcategory in data_dump:
+        if rng.random() < fraction and len(subcategory.items) > 2:
+            items = list(reversed(subcategory.items[:-1]))
+            new_id = 40000 + subcategory.subcategory_id
+            items.append(CatalogueItem(new_id, f"Item {new_id}", new_id, 0))
+            items = tuple(item._replace(display_order=index + 1) for index, item in enumerate(items))
+            subcategory = subcategory._replace(items=items)
+        mutated.append(subcategory)
+    return mutated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dumper against a synthetic cache archive.")
+    parser.add_argument("--subcategories", type=int, default=20, help="Subcategories per category enum.")
+    parser.add_argument("--items", type=int, default=30, help="Items per subcategory.")
+    parser.add_argument("--noise", type=int, default=5000, help="Unrelated enums and structs in the archive.")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions of every stage.")
+    parser.add_argument("--mutate", type=float, default=0.1, help="Fraction of subcategories changed for the incremental load.")
+    parser.add_argument("--reset", action="store_true", help="Truncate the catalogue tables of the target database. Required for the database stages.")
+    parser.add_argument("--skip-db", action="store_true", help="Only benchmark the archive and parse stages.")
+    parser.add_argument("--output", help="Write the results as JSON to this path.")
+    args = parser.parse_args()
+
+    if not args.skip_db and not args.reset:
+        parser.error("the database stages truncate the catalogue tables, pass --reset to confirm or --skip-db")
+
+    work_dir = tempfile.mkdtemp(prefix="dumper-bench-")
+    archive_path = os.path.join(work_dir, "cache.tar.gz")
+    item_ids = build_synthetic_cache(archive_path, args.subcategories, args.items, args.noise)
+    server = start_stand_in(item_ids)
+    configure_environment(f"http://127.0.0.1:{server.server_port}", os.path.join(work_dir, "cache"))
+
+    import db
+    import dump
+    import metrics
+    from cache_source import DirectoryCacheSource, TarballCacheSource
+    from download_cache import extract_specific_folders_tarfile
+
+    total_items = len(CATEGORY_ENUM_IDS) * args.subcategories * args.items
+    results = {}
+
+    def measure(name, func, units=None):
+        metrics.reset()
+        start = time.perf_counter()
+        value = func()
+        elapsed = time.perf_counter() - start
+        run_report = metrics.report()
+        entry = results.setdefault(name, {"seconds": [], "sql_statements": [], "units": units})
+        entry["seconds"].append(elapsed)
+        entry["sql_statements"].append(run_report["timings"].get("sql_statement", {}).get("count", 0))
+        return value
+
+    def reset_database():
+        conn = db.connect_db()
+        with conn.cursor() as cur:
+            cur.execute("TRUNCATE subcategory_items, subcategories, categories RESTART IDENTITY CASCADE;")
+        conn.commit()
+        conn.close()
+
+    data_dump = None
+    for iteration in range(args.repeat):
+        extract_dir = os.path.join(work_dir, f"extract-{iteration}")
+        measure("extract_to_disk", lambda: extract_specific_folders_tarfile(archive_path, extract_dir, ["dump/enums", "dump/structs"]))
+        measure("read_cache_from_disk", lambda: dump.load_cache(DirectoryCacheSource(os.path.join(extract_dir, "dump"))))
+        measure("read_cache_streaming", lambda: dump.load_cache(TarballCacheSource(archive_path, dump.ITEMS_ENUM_PARAM)))
+        measure("item_names", dump.populate_item_names)
+        dump.item_replacements.clear()
+        dump.populate_item_replacements()
+        data_dump = measure("process_all_enums", dump.process_all_enums, total_items)
+
+        if not args.skip_db:
+            reset_database()
+            StandInHandler.objects.clear()
+            measure("update_db_cold", lambda: db.update_db(data_dump), total_items)
+            measure("update_db_unchanged", lambda: db.update_db(data_dump), total_items)
+            mutated = mutate_dump(data_dump, args.mutate)
+            measure("update_db_incremental", lambda: db.update_db(mutated), total_items)
+
+    server.shutdown()
+
+    print(f"{len(CATEGORY_ENUM_IDS) * args.subcategories} subcategories, {total_items} items, "
+          f"{args.noise} noise files, {args.repeat} repetitions")
+    print(f"{'stage':<24}{'median s':>10}{'min s':>10}{'max s':>10}{'items/s':>12}{'sql':>8}")
+    summary = {}
+    for name, entry in results.items():
+        median = statistics.median(entry["seconds"])
+        throughput = entry["units"] / median if entry["units"] and median > 0 else None
+        summary[name] = {
+            "median_seconds": median,
+            "min_seconds": min(entry["seconds"]),
+            "max_seconds": max(entry["seconds"]),
+            "items_per_second": throughput,
+            "sql_statements": statistics.median(entry["sql_statements"]),
+        }
+        print(f"{name:<24}{median:>10.4f}{min(entry['seconds']):>10.4f}{max(entry['seconds']):>10.4f}"
+              f"{(f'{throughput:.0f}' if throughput else '-'):>12}{summary[name]['sql_statements']:>8.0f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"parameters": vars(args), "stages": summary}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
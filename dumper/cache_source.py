@@ -0,0 +1,218 @@
+import io
+import json
+import logging
+import os
+import re
+import tarfile
+import zipfile
+
+import metrics
+
+CACHE_MEMBER_PATTERN = re.compile(r'(?:^|/)dump/(enums|structs)/(\d+)\.json$')
+JSON_DECODER = os.environ.get("DUMPER_JSON_DECODER", "json")
+
+
+def get_json_loads(decoder: str):
+    """Returns the loads function of the requested JSON decoder, falling back to the standard library."""
+    if decoder == "orjson":
+        try:
+            import orjson
+            return orjson.loads
+        except ImportError:
+            logging.warning("orjson is not installed, using the standard json decoder")
+    elif decoder != "json":
+        logging.warning(f"Unknown JSON decoder '{decoder}', using the standard json decoder")
+    return json.loads
+
+
+class CacheSource:
+    """Raw enum and struct JSON files from an osrs-cache dump, looked up by kind ('enums'/'structs') and id."""
+
+    def read(self, kind: str, file_id: int):
+        raise NotImplementedError
+
+    def retain(self, files: dict):
+        """Drops every file not in files ({kind: set of ids}). Sources that read on demand hold nothing to drop."""
+        pass
+
+    def close(self):
+        pass
+
+
+class DirectoryCacheSource(CacheSource):
+    """An extracted dump folder, e.g. the output of extract_specific_folders_tarfile."""
+
+    def __init__(self, root: str = 'dump'):
+        self.root = root
+
+    def read(self, kind: str, file_id: int):
+        file_path = os.path.join(self.root, kind, f'{file_id}.json')
+        try:
+            with open(file_path, 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            logging.error(f"Error: File not found at {file_path}")
+            return None
+
+
+class TarballCacheSource(CacheSource):
+    """
+    A .tar.gz release, read in a single streaming pass without extracting it. Structs that can't be
+    collection log subcategories (no items enum param) are dropped while streaming.
+    """
+
+    def __init__(self, file_path: str, items_enum_param: str):
+        self.file_path = file_path
+        self._files = {'enums': {}, 'structs': {}}
+        items_enum_marker = f'"{items_enum_param}"'.encode()
+
+        with tarfile.open(file_path, 'r|gz') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                match = CACHE_MEMBER_PATTERN.search(member.name)
+                if not match:
+                    continue
+
+                kind = match.group(1)
+                data = tar.extractfile(member).read()
+                metrics.incr("cache_members_read")
+                if kind == 'structs' and items_enum_marker not in data:
+                    continue
+                self._files[kind][int(match.group(2))] = data
+
+        logging.debug(f"Read {len(self._files['enums'])} enums and {len(self._files['structs'])} "
+                      f"candidate structs from {file_path}")
+
+    def read(self, kind: str, file_id: int):
+        data = self._files[kind].get(file_id)
+        if data is None:
+            logging.error(f"Error: {kind} {file_id} not found in {self.file_path}")
+        return data
+
+    def retain(self, files: dict):
+        for kind, kept in self._files.items():
+            self._files[kind] = {file_id: data for file_id, data in kept.items() if file_id in files.get(kind, ())}
+        logging.debug(f"Kept {len(self._files['enums'])} enums and {len(self._files['structs'])} structs "
+                      f"from {self.file_path}")
+
+    def close(self):
+        self._files = {'enums': {}, 'structs': {}}
+
+
+class ZipCacheSource(CacheSource):
+    """A zip archive held in memory, given as raw bytes or a path."""
+
+    def __init__(self, archive):
+        if isinstance(archive, (bytes, bytearray)):
+            self.name = '<memory>'
+            self._archive = bytes(archive)
+        else:
+            self.name = archive
+            with open(archive, 'rb') as file:
+                self._archive = file.read()
+
+        self._zip = zipfile.ZipFile(io.BytesIO(self._archive))
+        self._names = {}
+        for name in self._zip.namelist():
+            match = CACHE_MEMBER_PATTERN.search(name)
+            if match:
+                self._names[(match.group(1), int(match.group(2)))] = name
+
+    def __reduce__(self):
+        # ZipFile handles can't be pickled, rebuild from the archive bytes (e.g. in parse workers)
+        return ZipCacheSource, (self._archive,)
+
+    def read(self, kind: str, file_id: int):
+        name = self._names.get((kind, file_id))
+        if name is None:
+            logging.error(f"Error: {kind} {file_id} not found in {self.name}")
+            return None
+        return self._zip.read(name)
+
+    def close(self):
+        self._zip.close()
+
+
+class CacheStore:
+    """Parsed enums and structs indexed by id. Each file is read and decoded at most once."""
+
+    def __init__(self, source: CacheSource, json_loads=None):
+        self._source = source
+        self._json_loads = json_loads or get_json_loads(JSON_DECODER)
+        self._parsed = {'enums': {}, 'structs': {}}
+
+    @property
+    def source(self):
+        return self._source
+
+    def reachable(self, category_enum_ids, extra_enum_ids, items_enum_param: str) -> dict:
+        """
+        Returns {kind: set of ids} of the files the catalogue is built from: the given enums, the structs
+        the category enums list and those structs' item enums. Structs are only parsed to find their item
+        enum and are evicted again, item enums aren't parsed at all.
+        """
+        files = {'enums': set(), 'structs': set()}
+        for enum_id in list(category_enum_ids) + list(extra_enum_ids):
+            files['enums'].add(enum_id)
+
+        for enum_id in category_enum_ids:
+            for struct_id in (self.enum(enum_id) or {}).get('intVals', []):
+                files['structs'].add(struct_id)
+                items_enum = (self.struct(struct_id) or {}).get('params', {}).get(items_enum_param)
+                if items_enum is not None:
+                    files['enums'].add(items_enum)
+                self.evict('structs', struct_id)
+        return files
+
+    def evict(self, kind: str, file_id: int):
+        """Forgets a parsed file, it is read from the source again if needed. Preloaded stores keep everything."""
+        if self._source is not None:
+            self._parsed[kind].pop(file_id, None)
+
+    @classmethod
+    def build(cls, source: CacheSource, category_enum_ids, extra_enum_ids, items_enum_param: str, json_loads=None):
+        """Loads every enum and struct reachable from the given enums up front, then releases the source."""
+        store = cls(source, json_loads)
+        for enum_id in list(category_enum_ids) + list(extra_enum_ids):
+            store.enum(enum_id)
+
+        for enum_id in category_enum_ids:
+            for struct_id in (store.enum(enum_id) or {}).get('intVals', []):
+                struct = store.struct(struct_id)
+                items_enum = (struct or {}).get('params', {}).get(items_enum_param)
+                if items_enum is not None:
+                    store.enum(items_enum)
+
+        logging.debug(f"Cache store built with {len(store._parsed['enums'])} enums "
+                      f"and {len(store._parsed['structs'])} structs")
+        source.close()
+        store._source = None
+        return store
+
+    def enum(self, enum_id: int):
+        return self._get('enums', enum_id)
+
+    def struct(self, struct_id: int):
+        return self._get('structs', struct_id)
+
+    def _get(self, kind: str, file_id: int):
+        parsed = self._parsed[kind]
+        if file_id in parsed:
+            return parsed[file_id]
+
+        data = None
+        if self._source is None:
+            logging.error(f"Error: {kind} {file_id} is not in the cache store")
+        else:
+            raw = self._source.read(kind, file_id)
+            if raw is not None:
+                metrics.incr("cache_files_parsed")
+                metrics.incr("cache_bytes_parsed", len(raw))
+                try:
+                    data = self._json_loads(raw)
+                except json.JSONDecodeError as e:
+                    logging.error(f"Error decoding JSON for {kind} {file_id}: {e}")
+
+        parsed[file_id] = data
+        return data
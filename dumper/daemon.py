@@ -0,0 +1,186 @@
+"""
+Keeps the dumper running and loads each new osrs-cache release as soon as it is published, instead of
+waiting for the next scheduled run. Between polls the database pools, HTTP sessions, B2 client, archive
+cache and item names snapshot stay warm, and the release endpoint is polled with If-None-Match.
+
+    python main.py --daemon --poll-interval 300 --health-port 8080
+"""
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import db
+import metrics
+from download_cache import delete_files
+
+DAEMON_POLL_INTERVAL = float(os.environ.get("DAEMON_POLL_INTERVAL", 300))  # Seconds
+DAEMON_HEALTH_HOST = os.environ.get("DAEMON_HEALTH_HOST", "127.0.0.1")
+DAEMON_HEALTH_PORT = int(os.environ.get("DAEMON_HEALTH_PORT", 8080))  # 0 disables the endpoint
+DAEMON_MAX_FAILURES = int(os.environ.get("DAEMON_MAX_FAILURES", 3))  # Consecutive failed polls before unhealthy
+
+
+def _timestamp(value):
+    return datetime.fromtimestamp(value, timezone.utc).isoformat() if value else None
+
+
+class DaemonState:
+    """What the health endpoint reports. Updated by the poll loop, read by the HTTP server threads."""
+
+    def __init__(self, poll_interval: float):
+        self.poll_interval = poll_interval
+        self.started_at = time.time()
+        self.status = "starting"
+        self.polls = 0
+        self.loads = 0
+        self.consecutive_failures = 0
+        self.last_poll_at = None
+        self.last_success_at = None
+        self.last_load_at = None
+        self.last_report = None
+        self._lock = threading.Lock()
+
+    def poll_started(self):
+        with self._lock:
+            self.status = "polling"
+
+    def poll_finished(self, success: bool, loaded: bool, run_report: dict):
+        with self._lock:
+            now = time.time()
+            self.status = "idle"
+            self.polls += 1
+            self.last_poll_at = now
+            self.last_report = run_report
+            if success:
+                self.consecutive_failures = 0
+                self.last_success_at = now
+            else:
+                self.consecutive_failures += 1
+            if loaded and success:
+                self.loads += 1
+                self.last_load_at = now
+
+    def healthy(self) -> bool:
+        with self._lock:
+            # A poll that never finishes (hung download, lost database) counts as unhealthy too
+            reference = self.last_poll_at or self.started_at
+            overdue = time.time() - reference > 3 * self.poll_interval + 600
+            return self.consecutive_failures < DAEMON_MAX_FAILURES and not overdue
+
+    def to_dict(self) -> dict:
+        healthy = self.healthy()
+        with self._lock:
+            return {
+                "healthy": healthy,
+                "status": self.status,
+                "started_at": _timestamp(self.started_at),
+                "poll_interval_seconds": self.poll_interval,
+                "polls": self.polls,
+                "loads": self.loads,
+                "consecutive_failures": self.consecutive_failures,
+                "last_poll_at": _timestamp(self.last_poll_at),
+                "last_success_at": _timestamp(self.last_success_at),
+                "last_load_at": _timestamp(self.last_load_at),
+            }
+
+    def to_prometheus(self) -> str:
+        state = self.to_dict()
+        prefix = metrics.METRICS_PREFIX
+        lines = [
+            f"# TYPE {prefix}_daemon_healthy gauge",
+            f"{prefix}_daemon_healthy {1 if state['healthy'] else 0}",
+            f"# TYPE {prefix}_daemon_polls_total counter",
+            f"{prefix}_daemon_polls_total {state['polls']}",
+            f"# TYPE {prefix}_daemon_loads_total counter",
+            f"{prefix}_daemon_loads_total {state['loads']}",
+            f"# TYPE {prefix}_daemon_consecutive_failures gauge",
+            f"{prefix}_daemon_consecutive_failures {state['consecutive_failures']}",
+        ]
+        with self._lock:
+            run_report = self.last_report
+        # The last completed poll, in the same format as the one-shot run's textfile
+        body = "\n".join(lines) + "\n"
+        return body + metrics.to_prometheus(run_report) if run_report else body
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    """GET /healthz for container health checks, GET /metrics for Prometheus."""
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: str, content_type: str):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            state = self.state.to_dict()
+            self._send(200 if state["healthy"] else 503, json.dumps(state), "application/json")
+        elif self.path == "/metrics":
+            self._send(200, self.state.to_prometheus(), "text/plain; version=0.0.4")
+        else:
+            self._send(404, "Not found", "text/plain")
+
+
+def serve_health(state: DaemonState, host: str, port: int) -> ThreadingHTTPServer:
+    handler = type("BoundHealthHandler", (HealthHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="health", daemon=True).start()
+    logging.info(f"Health endpoint listening on http://{host}:{server.server_port}/healthz")
+    return server
+
+
+def run_daemon(run_once, poll_interval: float = DAEMON_POLL_INTERVAL, health_port: int = DAEMON_HEALTH_PORT) -> int:
+    """
+    Calls run_once (main.run) every poll_interval seconds until SIGTERM/SIGINT. A poll whose release was
+    already applied only costs a conditional request and one query per target.
+    """
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        logging.info("Stopping after the current poll...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    db.use_connection_pools()
+    state = DaemonState(poll_interval)
+    server = serve_health(state, DAEMON_HEALTH_HOST, health_port) if health_port else None
+    logging.info(f"Dumper daemon polling for new cache releases every {poll_interval:g}s")
+
+    try:
+        while not stop.is_set():
+            metrics.reset()
+            state.poll_started()
+            exit_code = 1
+            try:
+                exit_code = run_once()
+            except Exception:
+                logging.exception("Unexpected error during a poll")
+            finally:
+                with metrics.stage("cleanup"):
+                    delete_files()
+            run_report = metrics.report(exit_code == 0)
+            # Polls that found nothing new aren't worth a report line every few minutes
+            loaded = "download" in run_report["stages"]
+            if loaded or exit_code != 0:
+                run_report = metrics.export(exit_code == 0)
+            state.poll_finished(exit_code == 0, loaded, run_report)
+            stop.wait(poll_interval)
+    finally:
+        if server:
+            server.shutdown()
+        db.close_connection_pools()
+
+    return 0
@@ -1,10 +1,21 @@
+import hashlib
+import io
+import json
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
 import psycopg2
 
 from psycopg2.extras import execute_values
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 
-from images import download_image
+import metrics
+from atlas import update_atlases
+from images import download_images
+from snapshot import publish_catalogue_snapshot
 
 DB_NAME = os.environ.get("DB_NAME", "clogged")
 DB_USER = os.environ.get("DB_USER", "postgres")
@@ -20,190 +31,689 @@ DB_CONFIG = {
     "port": DB_PORT
 }
 
-def connect_db():
-    """Establishes a connection to the PostgreSQL database."""
+# Comma separated connection strings (libpq key=value or postgresql:// URIs). When set, one parse of the
+# cache is loaded into every one of them instead of the DB_* database.
+DB_TARGETS = [dsn.strip() for dsn in os.environ.get("DB_TARGETS", "").split(",") if dsn.strip()]
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 4))  # Connections kept per target when pooling is on
+
+# Target -> pool, only used once use_connection_pools() is called (daemon mode). One-shot runs connect directly.
+_pools = {}
+_pooled_connections = {}  # id(connection) -> the pool it came from
+_pools_lock = threading.Lock()
+_pooling = False
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Records the count and latency of every statement for the run report."""
+
+    def execute(self, query, vars=None):
+        with metrics.timed("sql_statement"):
+            return super().execute(query, vars)
+
+    def copy_expert(self, sql, file, size=8192):
+        with metrics.timed("sql_copy"):
+            return super().copy_expert(sql, file, size)
+
+def get_db_targets(dsns: list = None) -> list:
+    """The connection strings to load, [None] meaning the DB_* database."""
+    return list(dsns or DB_TARGETS) or [None]
+
+def target_name(dsn: str = None) -> str:
+    """host:port/dbname of a target, for logs and results. Never includes the password."""
+    if dsn is None:
+        return f"{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    params = psycopg2.extensions.parse_dsn(dsn)
+    return f"{params.get('host', 'localhost')}:{params.get('port', '5432')}/{params.get('dbname', '')}"
+
+def use_connection_pools(enabled: bool = True):
+    """Makes connect_db hand out pooled connections, kept open between runs. release_db returns them."""
+    global _pooling
+    _pooling = enabled
+
+def close_connection_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
+        _pooled_connections.clear()
+
+def _pooled_connection(dsn: str = None):
+    with _pools_lock:
+        pool = _pools.get(dsn)
+        if pool is None:
+            connect_args = {"dsn": dsn} if dsn else DB_CONFIG
+            pool = ThreadedConnectionPool(0, DB_POOL_SIZE, cursor_factory=TimedCursor, **connect_args)
+            _pools[dsn] = pool
+
+    conn = pool.getconn()
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        logging.debug("Successfully connected to the database.")
+        # Connections can be dropped by the server while idle in the pool
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1;")
+        conn.rollback()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        logging.debug(f"Discarding a dead pooled connection to {target_name(dsn)}")
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    with _pools_lock:
+        _pooled_connections[id(conn)] = pool
+    return conn
+
+def release_db(conn):
+    """Returns a connection to its pool, rolled back and with default session settings, or closes it."""
+    with _pools_lock:
+        pool = _pooled_connections.pop(id(conn), None)
+    if pool is None:
+        conn.close()
+        return
+    try:
+        conn.reset()
+        pool.putconn(conn)
+    except (psycopg2.Error, PoolError):
+        pool.putconn(conn, close=True)
+
+def connect_db(dsn: str = None):
+    """Establishes a connection to the PostgreSQL database, the DB_* one unless a connection string is given."""
+    try:
+        if _pooling:
+            conn = _pooled_connection(dsn)
+        elif dsn:
+            conn = psycopg2.connect(dsn, cursor_factory=TimedCursor)
+        else:
+            conn = psycopg2.connect(**DB_CONFIG, cursor_factory=TimedCursor)
+        logging.debug(f"Successfully connected to the database {target_name(dsn)}.")
         return conn
-    except psycopg2.OperationalError as e:
-        logging.error(f"Database connection failed: {e}")
+    except (psycopg2.OperationalError, PoolError) as e:
+        logging.error(f"Database connection to {target_name(dsn)} failed: {e}")
+        return None
+
+def get_last_release_fingerprint(dsn: str = None):
+    conn = connect_db(dsn)
+    if not conn:
         return None
 
-def upsert_categories(conn):
     sql = """
-        INSERT INTO categories (id, name)
-        VALUES (%s, %s)
-        ON CONFLICT (id) DO NOTHING;
+        SELECT tag, asset_id, checksum
+        FROM cache_releases
+        ORDER BY applied_at DESC
+        LIMIT 1;
     """
     try:
         with conn.cursor() as cur:
-            for category_id, category_name in enumerate(["Bosses", "Raids", "Clues", "Minigames", "Other"], start=1):
-                cur.execute(sql, (category_id, category_name))
-            conn.commit()
-            logging.debug("Upserted categories.")
+            cur.execute(sql)
+            row = cur.fetchone()
+            if row is None:
+                return None
+            return {"tag": row[0], "asset_id": row[1], "checksum": row[2]}
     except psycopg2.Error as e:
-        logging.error(f"Database error during upsert of categories: {e}")
-        conn.rollback()
+        logging.warning(f"Could not read the last applied cache release: {e}")
+        return None
+    finally:
+        release_db(conn)
+
+def record_release_fingerprint(fingerprint: dict, dsn: str = None):
+    conn = connect_db(dsn)
+    if not conn:
+        return
 
-def upsert_subcategory(conn, subcategory_id: int, subcategory_name: str, category_id: int, total: int):
     sql = """
-        INSERT INTO subcategories (id, name, categoryid, total)
-        VALUES (%s, %s, %s, %s)
-        ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name, categoryid = EXCLUDED.categoryid, total = EXCLUDED.total
-        WHERE subcategories.name != EXCLUDED.name
-           OR subcategories.categoryid != EXCLUDED.categoryid
-           OR subcategories.total != EXCLUDED.total
-        RETURNING id;
+        INSERT INTO cache_releases (tag, asset_id, checksum)
+        VALUES (%s, %s, %s);
     """
     try:
         with conn.cursor() as cur:
-            cur.execute(sql, (subcategory_id, subcategory_name, category_id, total))
-            changed = cur.fetchone() is not None
+            cur.execute(sql, (fingerprint["tag"], fingerprint["asset_id"], fingerprint["checksum"]))
             conn.commit()
-            if changed:
-                logging.info(f"Subcategory updated: {subcategory_name} (id={subcategory_id})")
-            else:
-                logging.debug(f"Subcategory unchanged: {subcategory_name} (id={subcategory_id})")
-            return changed
+            logging.debug(f"Recorded cache release {fingerprint['tag']} as applied to {target_name(dsn)}.")
     except psycopg2.Error as e:
-        logging.error(f"Database error during upsert of subcategory {subcategory_id}: {e}")
+        logging.error(f"Database error while recording cache release {fingerprint['tag']}: {e}")
         conn.rollback()
-        return False
+    finally:
+        release_db(conn)
 
+CATEGORIES = ["Bosses", "Raids", "Clues", "Minigames", "Other"]
+# Subcategories copied to the staging tables at a time. Only one batch of the parse is held in memory.
+STAGE_BATCH_SIZE = int(os.environ.get("STAGE_BATCH_SIZE", 50))
+# Subcategories whose profile completion rows are recomputed per statement (and transaction)
+COMPLETION_BATCH_SIZE = int(os.environ.get("COMPLETION_BATCH_SIZE", 20))
 
-def upsert_subcategory_items(conn, subcategory_id: int, subcategory_name: str, items: list):
-    sql_insert = """
-                 INSERT INTO subcategory_items (subcategoryid, itemid, itemname, originalitemid, displayorder)
-                 VALUES %s
-                ON CONFLICT (subcategoryid, itemid)
-                 DO UPDATE SET originalitemid = EXCLUDED.originalitemid, itemname = EXCLUDED.itemname, displayorder = EXCLUDED.displayorder;
-                 """
+STAGING_TABLES_SQL = """
+    CREATE TEMP TABLE stage_subcategories
+    (
+        id             integer PRIMARY KEY,
+        name           text,
+        categoryid     integer,
+        content_digest text
+    ) ON COMMIT DROP;
+
+    CREATE TEMP TABLE stage_subcategory_items
+    (
+        subcategoryid  integer,
+        itemid         integer,
+        itemname       text,
+        originalitemid integer,
+        displayorder   integer
+    ) ON COMMIT DROP;
+"""
+
+def subcategory_digest(subcategory) -> str:
+    """Hash of everything the loader writes for a subcategory, used to skip unchanged ones."""
+    content = [
+        subcategory.name,
+        subcategory.category_id,
+        # [itemId, itemName, originalItemId, displayorder] per item
+        [list(item) for item in subcategory.items]
+    ]
+    return hashlib.sha256(json.dumps(content, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+def get_subcategory_digests(cur) -> dict:
+    cur.execute("SELECT id, content_digest FROM subcategories;")
+    return dict(cur.fetchall())
+
+def _copy_value(value) -> str:
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+def copy_rows(cur, table: str, columns: list, rows):
+    """Bulk loads rows into a table with COPY ... FROM STDIN (text format)."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+def upsert_categories(cur):
+    sql = """
+        INSERT INTO categories (id, name)
+        VALUES %s
+        ON CONFLICT (id) DO NOTHING;
+    """
+    execute_values(cur, sql, list(enumerate(CATEGORIES, start=1)))
+    logging.debug("Upserted categories.")
+
+def stage_subcategories(cur, batch: list):
+    """Appends (subcategory, digest) pairs to the staging tables, one COPY per table."""
+    copy_rows(cur, "stage_subcategories", ["id", "name", "categoryid", "content_digest"], (
+        (subcategory.subcategory_id, subcategory.name, subcategory.category_id, digest) for subcategory, digest in batch
+    ))
+    copy_rows(cur, "stage_subcategory_items", ["subcategoryid", "itemid", "itemname", "originalitemid", "displayorder"], (
+        (subcategory.subcategory_id, *item) for subcategory, _ in batch for item in subcategory.items
+    ))
+    logging.debug(f"Staged {len(batch)} subcategories.")
+
+def record_catalogue_changes(cur, release_tag: str = None):
+    """
+    Diffs the staged subcategories against the stored ones and writes the differences to catalogue_changes
+    under a new catalogue version. Must run before the merge. Returns (version, change count), or
+    (None, 0) if nothing differs, in which case no version is created.
+    """
+    sql = """
+        WITH staged_items AS (
+            SELECT DISTINCT ON (subcategoryid, itemid) subcategoryid, itemid, itemname, originalitemid, displayorder
+            FROM stage_subcategory_items
+            ORDER BY subcategoryid, itemid, displayorder),
+             changes AS (
+                 -- Subcategories that are new, renamed or moved to another category
+                 SELECT CASE WHEN sub.id IS NULL THEN 'added' ELSE 'renamed' END AS change,
+                        s.id                                                    AS subcategory_id,
+                        NULL::integer                                           AS item_id,
+                        NULL::integer                                           AS original_item_id,
+                        s.name,
+                        s.categoryid                                            AS category_id,
+                        NULL::integer                                           AS display_order,
+                        0                                                       AS kind
+                 FROM stage_subcategories s
+                          LEFT JOIN subcategories sub ON sub.id = s.id
+                 WHERE sub.id IS NULL
+                    OR (sub.name, sub.categoryid) IS DISTINCT FROM (s.name, s.categoryid)
+                 UNION ALL
+                 -- Items that are new, renamed (or now resolve to another item) or moved within the subcategory
+                 SELECT CASE
+                            WHEN si.id IS NULL THEN 'added'
+                            WHEN (si.itemname, si.originalitemid) IS DISTINCT FROM (st.itemname, st.originalitemid)
+                                THEN 'renamed'
+                            ELSE 'reordered' END,
+                        st.subcategoryid,
+                        st.itemid,
+                        st.originalitemid,
+                        st.itemname,
+                        NULL,
+                        st.displayorder,
+                        1
+                 FROM staged_items st
+                          LEFT JOIN subcategory_items si ON si.subcategoryid = st.subcategoryid AND si.itemid = st.itemid
+                 WHERE si.id IS NULL
+                    OR (si.itemname, si.originalitemid, si.displayorder)
+                     IS DISTINCT FROM (st.itemname, st.originalitemid, st.displayorder)
+                 UNION ALL
+                 -- Items no longer in their subcategory
+                 SELECT 'removed', si.subcategoryid, si.itemid, si.originalitemid, NULL, NULL, NULL, 1
+                 FROM subcategory_items si
+                          JOIN stage_subcategories s ON s.id = si.subcategoryid
+                 WHERE NOT EXISTS (SELECT 1
+                                   FROM stage_subcategory_items st
+                                   WHERE st.subcategoryid = si.subcategoryid
+                                     AND st.itemid = si.itemid)),
+             version AS (
+                 INSERT INTO catalogue_versions (release_tag)
+                 SELECT %s
+                 WHERE EXISTS (SELECT 1 FROM changes)
+                 RETURNING id),
+             inserted AS (
+                 INSERT INTO catalogue_changes (version, change, subcategory_id, item_id, original_item_id, name,
+                                                category_id, display_order)
+                 SELECT version.id, c.change, c.subcategory_id, c.item_id, c.original_item_id, c.name, c.category_id,
+                        c.display_order
+                 FROM changes c
+                          CROSS JOIN version
+                 -- Subcategories before their items, removals before the items that may take their place
+                 ORDER BY c.kind, c.subcategory_id, c.change != 'removed', c.display_order, c.item_id
+                 RETURNING version)
+        SELECT version, COUNT(*)
+        FROM inserted
+        GROUP BY version;
+    """
+    # Versions are handed out and committed one loader at a time, so a client that has seen version N
+    # can never miss a lower one committed later
+    cur.execute("LOCK TABLE catalogue_versions IN EXCLUSIVE MODE;")
+    cur.execute(sql, (release_tag,))
+    row = cur.fetchone()
+    return (row[0], row[1]) if row else (None, 0)
+
+def merge_subcategories(cur) -> list:
+    sql = """
+        WITH upserted AS (
+            INSERT INTO subcategories (id, name, categoryid, total)
+            SELECT s.id,
+                   s.name,
+                   s.categoryid,
+                   (SELECT COUNT(DISTINCT st.itemid) FROM stage_subcategory_items st WHERE st.subcategoryid = s.id)
+            FROM stage_subcategories s
+            ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name, categoryid = EXCLUDED.categoryid, total = EXCLUDED.total
+            WHERE subcategories.name != EXCLUDED.name
+               OR subcategories.categoryid != EXCLUDED.categoryid
+               OR subcategories.total != EXCLUDED.total
+            RETURNING id, name)
+        SELECT id, name
+        FROM upserted;
+    """
+    sql_digest = """
+        UPDATE subcategories
+        SET content_digest = s.content_digest
+        FROM stage_subcategories s
+        WHERE subcategories.id = s.id
+          -- A forced run stages every subcategory, only rewrite the ones whose content changed
+          AND subcategories.content_digest IS DISTINCT FROM s.content_digest;
+    """
+    cur.execute(sql)
+    changed = cur.fetchall()
+    for subcategory_id, subcategory_name in changed:
+        logging.info(f"Subcategory updated: {subcategory_name} (id={subcategory_id})")
+    cur.execute(sql_digest)
+    return changed
+
+def merge_subcategory_items(cur) -> dict:
+    """
+    Applies the staged items and returns {subcategory_id: {"added_or_updated": n, "added": n, "removed": n}},
+    where added counts only newly inserted items.
+    """
+    sql_delete = """
+        WITH removed AS (
+            DELETE FROM subcategory_items si
+            USING stage_subcategories s
+            WHERE si.subcategoryid = s.id
+              AND NOT EXISTS (SELECT 1
+                              FROM stage_subcategory_items st
+                              WHERE st.subcategoryid = si.subcategoryid
+                                AND st.itemid = si.itemid)
+            RETURNING si.subcategoryid)
+        SELECT subcategoryid, COUNT(*)
+        FROM removed
+        GROUP BY subcategoryid;
+    """
+
+    sql_upsert = """
+        WITH merged AS (
+            INSERT INTO subcategory_items (subcategoryid, itemid, itemname, originalitemid, displayorder)
+            SELECT DISTINCT ON (subcategoryid, itemid) subcategoryid, itemid, itemname, originalitemid, displayorder
+            FROM stage_subcategory_items
+            ORDER BY subcategoryid, itemid, displayorder
+            ON CONFLICT (subcategoryid, itemid)
+            DO UPDATE SET originalitemid = EXCLUDED.originalitemid, itemname = EXCLUDED.itemname, displayorder = EXCLUDED.displayorder
+            -- Only rewrite rows that actually differ, unchanged rows produce no dead tuples
+            WHERE (subcategory_items.originalitemid, subcategory_items.itemname, subcategory_items.displayorder)
+                      IS DISTINCT FROM (EXCLUDED.originalitemid, EXCLUDED.itemname, EXCLUDED.displayorder)
+            RETURNING subcategoryid, xmax = 0 AS inserted)
+        SELECT subcategoryid, COUNT(*), COUNT(*) FILTER (WHERE inserted)
+        FROM merged
+        GROUP BY subcategoryid;
+    """
+
+    changes = {}
+    cur.execute(sql_delete)
+    for subcategory_id, removed in cur.fetchall():
+        changes.setdefault(subcategory_id, {"added_or_updated": 0, "added": 0, "removed": 0})["removed"] = removed
 
+    cur.execute(sql_upsert)
+    for subcategory_id, added_or_updated, added in cur.fetchall():
+        subcategory_changes = changes.setdefault(subcategory_id, {"added_or_updated": 0, "added": 0, "removed": 0})
+        subcategory_changes["added_or_updated"] = added_or_updated
+        subcategory_changes["added"] = added
+
+    return changes
+
+def refresh_completion(cur, subcategory_ids: list) -> int:
+    """
+    Recomputes the profile_subcategory_completion rows of the given subcategories, COMPLETION_BATCH_SIZE
+    subcategories per statement. Runs in the merge transaction, so the counts change together with the
+    items. Rows whose counts didn't change are left alone, and profiles that no longer own anything in a
+    subcategory lose its row. Returns the number of rows written or deleted.
+
+    The clog update worker rewrites the same rows per profile. Both lock them in (subcategory_id,
+    profile_id) order: rows to remove are first zeroed by the ordered upsert, then deleted, so neither
+    side can deadlock the other.
+    """
+    sql_upsert = """
+        WITH counts AS (
+            SELECT pi.profile_id,
+                   si.subcategoryid AS subcategory_id,
+                   COUNT(*)         AS owned_count,
+                   s.total          AS total_count
+            FROM subcategory_items si
+                     JOIN subcategories s ON s.id = si.subcategoryid
+                     JOIN player_items pi ON pi.itemid = si.itemid
+            WHERE si.subcategoryid = ANY (%(ids)s)
+            GROUP BY pi.profile_id, si.subcategoryid, s.total),
+             existing AS (
+                 SELECT profile_id, subcategory_id, total_count
+                 FROM profile_subcategory_completion
+                 WHERE subcategory_id = ANY (%(ids)s)),
+             upserted AS (
+                 INSERT INTO profile_subcategory_completion (profile_id, subcategory_id, owned_count, total_count)
+                 SELECT COALESCE(counts.profile_id, existing.profile_id)          AS profile_id,
+                        COALESCE(counts.subcategory_id, existing.subcategory_id) AS subcategory_id,
+                        COALESCE(counts.owned_count, 0),
+                        COALESCE(counts.total_count, existing.total_count)
+                 FROM counts
+                          FULL JOIN existing ON existing.profile_id = counts.profile_id
+                     AND existing.subcategory_id = counts.subcategory_id
+                 ORDER BY subcategory_id, profile_id
+                 ON CONFLICT (profile_id, subcategory_id)
+                 DO UPDATE SET owned_count = EXCLUDED.owned_count,
+                               total_count = EXCLUDED.total_count,
+                               updated_at  = CURRENT_TIMESTAMP
+                 WHERE (profile_subcategory_completion.owned_count, profile_subcategory_completion.total_count)
+                           IS DISTINCT FROM (EXCLUDED.owned_count, EXCLUDED.total_count)
+                 RETURNING owned_count)
+        SELECT COUNT(*)
+        FROM upserted
+        WHERE owned_count > 0;
+    """
+    # Only the rows zeroed above, which this transaction already holds
+    sql_delete = """
+        DELETE
+        FROM profile_subcategory_completion
+        WHERE subcategory_id = ANY (%(ids)s)
+          AND owned_count = 0;
+    """
+    subcategory_ids = sorted(subcategory_ids)
+    refreshed = 0
+    for start in range(0, len(subcategory_ids), COMPLETION_BATCH_SIZE):
+        batch = {"ids": subcategory_ids[start:start + COMPLETION_BATCH_SIZE]}
+        cur.execute(sql_upsert, batch)
+        refreshed += cur.fetchone()[0]
+        cur.execute(sql_delete, batch)
+        refreshed += cur.rowcount
+
+    if subcategory_ids:
+        logging.debug(f"Refreshed {refreshed} completion rows for {len(subcategory_ids)} subcategories")
+    return refreshed
+
+def find_missing_images(conn):
+    """
+    Returns (originalitemid, image_url, image_webp_url, image_webp_2x_url, row_count) for every item
+    with a row missing its image, one row per item however many subcategories it appears in. The URLs
+    are ones another row of the same item already has, if any. Returns None on a database error.
+    """
     sql_check = """
-                SELECT originalitemid
+                SELECT originalitemid,
+                       MAX(NULLIF(image_url, ''))         AS known_url,
+                       MAX(image_webp_url)                AS known_webp_url,
+                       MAX(image_webp_2x_url)             AS known_webp_2x_url,
+                       COUNT(*)                           AS row_count
                 FROM subcategory_items
-                WHERE subcategoryid = %s
-                  AND (image_url IS NULL OR image_url = '');
+                GROUP BY originalitemid
+                HAVING bool_or(image_url IS NULL OR image_url = '');
                 """
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql_check)
+            missing_image_items = cur.fetchall()
+        # Don't hold a transaction open while the images are fetched
+        conn.rollback()
+        return missing_image_items
+    except psycopg2.Error as e:
+        logging.error(f"Database error while checking for missing images: {e}")
+        conn.rollback()
+        return None
 
-    changes = {"added_or_updated": 0, "removed": 0, "images_downloaded": 0}
+def save_image_urls(conn, resolved: list) -> int:
+    update_sql = """
+                 UPDATE subcategory_items
+                 SET image_url         = v.image_url,
+                     image_webp_url    = COALESCE(v.image_webp_url, subcategory_items.image_webp_url),
+                     image_webp_2x_url = COALESCE(v.image_webp_2x_url, subcategory_items.image_webp_2x_url)
+                 FROM (VALUES %s) AS v(originalitemid, image_url, image_webp_url, image_webp_2x_url)
+                 WHERE subcategory_items.originalitemid = v.originalitemid
+                   AND (subcategory_items.image_url IS NULL OR subcategory_items.image_url = '');
+                 """
+    if not resolved:
+        return 0
 
     try:
         with conn.cursor() as cur:
-            # Count existing items before changes
-            cur.execute("SELECT COUNT(*) FROM subcategory_items WHERE subcategoryid = %s;", (subcategory_id,))
-            existing_count = cur.fetchone()[0]
+            execute_values(cur, update_sql, resolved, page_size=len(resolved))
+            logging.debug(f"Set image URLs on {cur.rowcount} rows for {len(resolved)} items")
+        conn.commit()
+    except psycopg2.Error as e:
+        logging.error(f"Database error while updating missing images: {e}")
+        conn.rollback()
+        return 0
 
-            item_ids_to_keep = [item["itemId"] for item in items]
+    metrics.incr("images_resolved", len(resolved))
+    return len(resolved)
 
-            if not item_ids_to_keep:
-                if existing_count > 0:
-                    cur.execute("DELETE FROM subcategory_items WHERE subcategoryid = %s;", (subcategory_id,))
-                    changes["removed"] = existing_count
+def update_missing_images(connections: list) -> list:
+    """
+    Fills in missing image URLs in every connected database. A sprite known to any of them is reused,
+    and the rest are downloaded and uploaded once for all of them. Returns the items resolved per database.
+    """
+    missing_per_connection = [find_missing_images(conn) or [] for conn in connections]
+
+    known_urls = {}
+    row_counts = {}
+    for missing_image_items in missing_per_connection:
+        for item_id, known_url, webp_url, webp_2x_url, row_count in missing_image_items:
+            if known_url:
+                known_urls.setdefault(item_id, (known_url, webp_url, webp_2x_url))
             else:
-                # Delete items not in the new list
-                sql_delete_old = "DELETE FROM subcategory_items WHERE subcategoryid = %s AND itemid NOT IN %s;"
-                cur.execute(sql_delete_old, (subcategory_id, tuple(item_ids_to_keep)))
-                changes["removed"] = cur.rowcount
-
-            if items:
-                execute_values(cur, sql_insert, [
-                    (subcategory_id, item["itemId"], item["itemName"], item["originalItemId"], item["displayorder"]) for
-                    item in items
-                ])
-                changes["added_or_updated"] = len(items) - (existing_count - changes["removed"])
+                row_counts[item_id] = row_counts.get(item_id, 0) + row_count
 
-            conn.commit()
+    to_download = sorted(item_id for item_id in row_counts if item_id not in known_urls)
+    for item_id in to_download:
+        logging.info(f"Downloading missing image for item {item_id} ({row_counts[item_id]} subcategory rows)")
 
-            # Check for missing images
-            cur.execute(sql_check, (subcategory_id,))
-            missing_image_items = cur.fetchall()
+    variant_urls = download_images(to_download)
+    for item_id, urls in zip(to_download, variant_urls):
+        if urls:
+            known_urls[item_id] = (urls["png"], urls.get("webp"), urls.get("webp_2x"))
 
-            if missing_image_items:
-                for item in missing_image_items:
-                    item_id = item[0]
-                    logging.info(f"Downloading missing image for item {item_id} in {subcategory_name}")
-                    public_url = download_image(item_id)
-                    if public_url:
-                        update_sql = """
-                            UPDATE subcategory_items
-                            SET image_url = %s
-                            WHERE subcategoryid = %s AND originalitemid = %s;
-                        """
-                        cur.execute(update_sql, (public_url, subcategory_id, item_id))
-                        changes["images_downloaded"] += 1
+    return [save_image_urls(conn, [(item_id, *known_urls[item_id])
+                                   for item_id, *_ in missing_image_items if item_id in known_urls])
+            for conn, missing_image_items in zip(connections, missing_per_connection)]
 
-            conn.commit()
+class CatalogueLoad:
+    """One target database's transaction while the parsed catalogue streams into its staging tables."""
+    __slots__ = ("name", "conn", "stored_digests", "changed", "failed")
 
-            # Update total
-            update_total_sql = """
-                               UPDATE subcategories
-                               SET total = (SELECT COUNT(*)
-                                            FROM subcategory_items
-                                            WHERE subcategoryid = %s)
-                               WHERE id = %s;
-                               """
-            cur.execute(update_total_sql, (subcategory_id, subcategory_id))
-            conn.commit()
+    def __init__(self, name: str, conn):
+        self.name = name
+        self.conn = conn
+        self.stored_digests = {}
+        self.changed = {}  # subcategory id -> name, for the staged subcategories
+        self.failed = False
+
+    def fail(self, message: str):
+        logging.error(f"{self.name}: {message}, no changes were applied")
+        self.conn.rollback()
+        self.failed = True
 
+def begin_load(dsn: str = None):
+    """Opens the transaction a target is loaded in and creates its staging tables. None if unreachable."""
+    conn = connect_db(dsn)
+    if not conn:
+        return None
+    load = CatalogueLoad(target_name(dsn), conn)
+    try:
+        with conn.cursor() as cur:
+            load.stored_digests = get_subcategory_digests(cur)
+            cur.execute(STAGING_TABLES_SQL)
     except psycopg2.Error as e:
-        logging.error(f"Database error during upsert of items for subcategory {subcategory_name} ({subcategory_id}): {e}")
-        conn.rollback()
-        return changes
+        load.fail(f"database error while preparing the load: {e}")
+    return load
+
+def stage_batch(load: CatalogueLoad, batch: list, force: bool):
+    """Stages the subcategories of a batch whose content digest differs from the target's."""
+    if load.failed:
+        return
+    changed = [(subcategory, digest) for subcategory, digest in batch
+               if force or load.stored_digests.get(subcategory.subcategory_id) != digest]
+    if not changed:
+        return
+    try:
+        with load.conn.cursor() as cur:
+            stage_subcategories(cur, changed)
+        load.changed.update((subcategory.subcategory_id, subcategory.name) for subcategory, _ in changed)
+    except psycopg2.Error as e:
+        load.fail(f"database error while staging the catalogue: {e}")
+
+def merge_catalogue(load: CatalogueLoad, parsed_count: int, release_tag: str = None):
+    """
+    Records the changelog and merges the staged subcategories, then commits, so readers see either the
+    old or the new catalogue along with its version. Returns the change counts, or None if nothing was applied.
+    """
+    total_changes = {"subcategories_changed": 0, "items_added_or_updated": 0, "items_removed": 0, "images_downloaded": 0,
+                     "atlases_built": 0, "completion_rows_refreshed": 0}
+    if load.failed:
+        return None
+    changed_subcategories = []
+    item_changes = {}
+    version, version_changes = None, 0
+    completion_rows = 0
+    logging.info(f"{load.name}: {len(load.changed)} of {parsed_count} subcategories differ from the database")
+
+    try:
+        with load.conn.cursor() as cur:
+            if load.changed:
+                upsert_categories(cur)
+                cur.execute("ANALYZE stage_subcategories; ANALYZE stage_subcategory_items;")
+                version, version_changes = record_catalogue_changes(cur, release_tag)
+                changed_subcategories = merge_subcategories(cur)
+                item_changes = merge_subcategory_items(cur)
+                # Only subcategories whose item set changed have different completion counts
+                resized = [subcategory_id for subcategory_id, changes in item_changes.items()
+                           if changes["added"] or changes["removed"]]
+                completion_rows = refresh_completion(cur, resized)
+        load.conn.commit()
+    except psycopg2.Error as e:
+        load.fail(f"database error while merging the catalogue: {e}")
+        return None
+
+    if version is not None:
+        logging.info(f"{load.name}: recorded {version_changes} changes as catalogue version {version}")
+        metrics.incr("catalogue_changes_recorded", version_changes)
+    metrics.incr("completion_rows_refreshed", completion_rows)
+
+    total_changes["subcategories_changed"] = len(changed_subcategories)
+    total_changes["completion_rows_refreshed"] = completion_rows
+    for subcategory_id, changes in sorted(item_changes.items()):
+        total_changes["items_added_or_updated"] += changes["added_or_updated"]
+        total_changes["items_removed"] += changes["removed"]
 
-    # Only log at INFO if something actually changed
-    has_changes = changes["removed"] > 0 or changes["added_or_updated"] > 0 or changes["images_downloaded"] > 0
-    if has_changes:
+        # Only log at INFO if something actually changed
         parts = []
         if changes["added_or_updated"] > 0:
             parts.append(f"{changes['added_or_updated']} items added/updated")
         if changes["removed"] > 0:
             parts.append(f"{changes['removed']} items removed")
-        if changes["images_downloaded"] > 0:
-            parts.append(f"{changes['images_downloaded']} images downloaded")
-        logging.info(f"{subcategory_name}: {', '.join(parts)}")
-    else:
-        logging.debug(f"{subcategory_name}: no changes")
+        if parts:
+            logging.info(f"{load.name}: {load.changed.get(subcategory_id, subcategory_id)}: {', '.join(parts)}")
 
-    return changes
+    return total_changes
 
-def update_db(data_dump: list):
-    conn = connect_db()
+def update_db(subcategories, force: bool = False, dsns: list = None, release_tag: str = None) -> dict:
+    """
+    Streams parsed subcategories into every target database (DB_TARGETS, or the DB_* one), each in its own
+    transaction, then resolves missing images once for all of them. The next batch is only pulled from
+    subcategories once every target has staged the last one, so a generator is never read ahead of the
+    slowest target. release_tag is recorded against the catalogue version each changed target gets.
+    Returns {target name: True if applied, False if its load failed, None if unreachable}.
+    """
+    targets = get_db_targets(dsns)
+    subcategories = iter(subcategories)
+    results = {}
+    target_changes = {}
+    connections = {}
+    loads = []
 
-    if not conn:
-        logging.error("Could not establish database connection. Exiting.")
-        return
+    try:
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            loads = list(executor.map(begin_load, targets))
+            active = [load for load in loads if load is not None]
 
-    total_changes = {"subcategories_changed": 0, "items_added_or_updated": 0, "items_removed": 0, "images_downloaded": 0}
+            parsed_count = 0
+            while active and (batch := list(islice(subcategories, STAGE_BATCH_SIZE))):
+                staged = [(subcategory, subcategory_digest(subcategory)) for subcategory in batch]
+                parsed_count += len(staged)
+                list(executor.map(lambda load: stage_batch(load, staged, force), active))
 
-    try:
-        upsert_categories(conn)
-        for data in data_dump:
-            name = data["subcategoryName"]
-            items = data["items"]
-            subcategory_id = data["subcategoryId"]
-            category_id = data["categoryId"]
-
-            sub_changed = upsert_subcategory(conn, subcategory_id, name, category_id, len(items))
-            if sub_changed:
-                total_changes["subcategories_changed"] += 1
-
-            item_changes = upsert_subcategory_items(conn, subcategory_id, name, items)
-            total_changes["items_added_or_updated"] += item_changes.get("added_or_updated", 0)
-            total_changes["items_removed"] += item_changes.get("removed", 0)
-            total_changes["images_downloaded"] += item_changes.get("images_downloaded", 0)
+            merged = list(executor.map(lambda load: merge_catalogue(load, parsed_count, release_tag), active))
+
+        for dsn, load in zip(targets, loads):
+            results[target_name(dsn)] = None if load is None else False
+        for load, changes in zip(active, merged):
+            if changes is not None:
+                connections[load.name] = load.conn
+                target_changes[load.name] = changes
+
+        images_resolved = update_missing_images(list(connections.values()))
+        built_atlases = {}
+        uploaded_snapshots = {}
+        for (name, conn), resolved in zip(connections.items(), images_resolved):
+            target_changes[name]["images_downloaded"] = resolved
+            target_changes[name]["atlases_built"] = update_atlases(conn, built_atlases)
+            # Last, so the snapshot includes the image URLs resolved above
+            publish_catalogue_snapshot(conn, uploaded_snapshots)
+            results[name] = True
     finally:
-        conn.close()
+        for load in loads:
+            if load is not None:
+                release_db(load.conn)
 
     # Final summary
-    has_any_changes = any(v > 0 for v in total_changes.values())
-    if has_any_changes:
-        logging.info(
-            f"Dumper complete: {total_changes['subcategories_changed']} subcategories changed, "
-            f"{total_changes['items_added_or_updated']} items added/updated, "
-            f"{total_changes['items_removed']} items removed, "
-            f"{total_changes['images_downloaded']} images downloaded"
-        )
-    else:
-        logging.info("Dumper complete: no changes detected")
+    for name, total_changes in target_changes.items():
+        if any(v > 0 for v in total_changes.values()):
+            logging.info(
+                f"Dumper complete for {name}: {total_changes['subcategories_changed']} subcategories changed, "
+                f"{total_changes['items_added_or_updated']} items added/updated, "
+                f"{total_changes['items_removed']} items removed, "
+                f"{total_changes['images_downloaded']} images downloaded, "
+                f"{total_changes['atlases_built']} atlases built, "
+                f"{total_changes['completion_rows_refreshed']} completion rows refreshed"
+            )
+        else:
+            logging.info(f"Dumper complete for {name}: no changes detected")
+
+    return results
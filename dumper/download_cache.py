@@ -1,17 +1,39 @@
-﻿import logging
+﻿import hashlib
+import json
+import logging
 import os
 import shutil
 import tarfile
 
 import requests
 
+import http_client
+import metrics
+
 # --- Configuration ---
 GITHUB_RELEASE_ENDPOINT = "https://api.github.com/repos/abextm/osrs-cache/releases/latest"
+CACHE_DIR = os.environ.get("DUMPER_CACHE_DIR", "cache")
+ARCHIVES_DIR = os.path.join(CACHE_DIR, "archives")
+DOWNLOADS_DIR = os.path.join(CACHE_DIR, "downloads")
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", 1024 * 1024))  # 1MB
+DOWNLOAD_ATTEMPTS = int(os.environ.get("DOWNLOAD_ATTEMPTS", 3))
+CACHE_KEEP_ARCHIVES = int(os.environ.get("CACHE_KEEP_ARCHIVES", 2))
+
+# The last release response and its ETag. A 304 doesn't count against GitHub's rate limit, which matters
+# when the daemon polls.
+_latest_release = {"etag": None, "data": None}
 
-def download_latest_cache():
+def fetch_latest_release():
+    headers = {}
+    if _latest_release["etag"]:
+        headers["If-None-Match"] = _latest_release["etag"]
     try:
         logging.debug(f"Fetching latest release information from {GITHUB_RELEASE_ENDPOINT}...")
-        response = requests.get(GITHUB_RELEASE_ENDPOINT, timeout=30)
+        response = http_client.get(GITHUB_RELEASE_ENDPOINT, headers=headers)
+        if response.status_code == 304:
+            logging.debug("Latest release not modified since the last check.")
+            metrics.incr("release_not_modified")
+            return _latest_release["data"]
         response.raise_for_status()  # Raise an exception for HTTP errors (4xx or 5xx)
     except requests.exceptions.HTTPError as e:
         if response.status_code == 404:
@@ -29,58 +51,196 @@ def download_latest_cache():
         return None
 
     release_data = response.json()
-    assets = release_data.get("assets", [])
-
-    if not assets:
+    if not release_data.get("assets"):
         logging.error(f"No assets found in the latest release for osrs-cache.")
         return None
 
-    target_asset = assets[0]
+    _latest_release["etag"] = response.headers.get("ETag")
+    _latest_release["data"] = release_data
+    return release_data
+
+def get_release_fingerprint(release_data: dict) -> dict:
+    """Identifies a cache release by its tag, the asset we download and that asset's checksum."""
+    asset = release_data["assets"][0]
+    # Older releases have no digest, fall back to the size and upload time of the asset
+    checksum = asset.get("digest") or f"{asset.get('size')}:{asset.get('updated_at')}"
+    return {
+        "tag": release_data.get("tag_name"),
+        "asset_id": asset.get("id"),
+        "checksum": checksum
+    }
+
+def download_latest_cache(release_data: dict = None):
+    if release_data is None:
+        release_data = fetch_latest_release()
+        if not release_data:
+            return None
+
+    target_asset = release_data["assets"][0]
     if not target_asset:
         logging.error("No assets found in the latest release.")
         return None
 
+    asset_id = target_asset["id"]
     asset_name = target_asset["name"]
     download_url = target_asset["browser_download_url"]
+    expected_sha256 = _parse_sha256_digest(target_asset.get("digest"))
+
+    os.makedirs(ARCHIVES_DIR, exist_ok=True)
+    os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+
+    metadata = _load_download_metadata(asset_id)
+    cached_path = _archive_path(metadata["sha256"]) if metadata else None
+    if cached_path and os.path.exists(cached_path):
+        if expected_sha256 and metadata["sha256"] == expected_sha256:
+            logging.info(f"Using cached cache archive: {asset_name}")
+            metrics.incr("archive_cache_hits")
+            return cached_path
+    else:
+        metadata = None
+
+    for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+        try:
+            path = _download_asset(asset_id, asset_name, download_url, expected_sha256, metadata)
+            if path:
+                _prune_archives()
+            return path
+        except requests.exceptions.RequestException as e:
+            # The partial file is kept so the next attempt resumes where this one stopped
+            logging.error(f"Error during download request (attempt {attempt}/{DOWNLOAD_ATTEMPTS}): {e}")
+        except IOError as e:
+            logging.error(f"Error writing file to disk: {e}")
+            _remove_partial(asset_id)
+            return None
+
+    return None
+
+def _download_asset(asset_id, asset_name, download_url, expected_sha256, metadata):
+    partial_path = os.path.join(DOWNLOADS_DIR, f"{asset_id}.part")
+    headers = {}
+    if metadata and metadata.get("etag"):
+        headers["If-None-Match"] = metadata["etag"]
+
+    partial_size = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+    partial_etag = _load_partial_etag(asset_id)
+    if partial_size > 0 and partial_etag:
+        headers["Range"] = f"bytes={partial_size}-"
+        headers["If-Range"] = partial_etag
 
     logging.debug(f"Downloading from: {download_url}")
 
-    try:
-        with requests.get(download_url, stream=True, timeout=120) as r:
-            r.raise_for_status()
-            total_size = int(r.headers.get('content-length', 0))
+    with http_client.get(download_url, headers=headers, stream=True, timeout=120) as r:
+        if r.status_code == 304:
+            logging.info(f"Cache archive not modified, using cached copy: {asset_name}")
+            metrics.incr("archive_cache_hits")
+            return _archive_path(metadata["sha256"])
+
+        if r.status_code == 416:
+            # Our partial file no longer lines up with the remote file
+            logging.warning(f"Cannot resume '{asset_name}', restarting the download.")
+            _remove_partial(asset_id)
+            return _download_asset(asset_id, asset_name, download_url, expected_sha256, None)
+
+        r.raise_for_status()
+        etag = r.headers.get("ETag")
+        hasher = hashlib.sha256()
+
+        if r.status_code == 206:
+            logging.info(f"Resuming download of '{asset_name}' from {partial_size / (1024 * 1024):.2f} MB")
+            with open(partial_path, "rb") as f:
+                for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+                    hasher.update(chunk)
+            mode = "ab"
+            downloaded_size = partial_size
+        else:
+            mode = "wb"
             downloaded_size = 0
-            chunk_size = 8192  # 8KB
-
-            with open(asset_name, "wb") as f:
-                for chunk in r.iter_content(chunk_size=chunk_size):
-                    f.write(chunk)
-                    downloaded_size += len(chunk)
-                    if total_size > 0:
-                        progress = (downloaded_size / total_size) * 100
-                        logging.debug(f"Downloading '{asset_name}'... {progress:.2f}% complete")
-                    else:
-                        logging.debug(f"Downloading '{asset_name}'... {downloaded_size / (1024 * 1024):.2f} MB downloaded")
-            logging.info(f"Downloaded cache: {asset_name}")
-            return asset_name
-    except requests.exceptions.HTTPError as e:
-        logging.error(f"\nError downloading file: {e}")
-        if os.path.exists(asset_name):  # Clean up partially downloaded file
-            os.remove(asset_name)
-            logging.error(f"Removed partially downloaded file: '{asset_name}'")
-    except requests.exceptions.RequestException as e:
-        logging.error(f"\nError during download request: {e}")
-        if os.path.exists(asset_name):  # Clean up
-            os.remove(asset_name)
-            logging.error(f"Removed partially downloaded file: '{asset_name}'")
-    except IOError as e:
-        logging.error(f"\nError writing file to disk: {e}")
-        if os.path.exists(asset_name):  # Clean up
-            os.remove(asset_name)
-            logging.error(f"Removed partially downloaded file: '{asset_name}'")
 
+        total_size = downloaded_size + int(r.headers.get('content-length', 0))
+        if etag:
+            _save_json(_partial_etag_path(asset_id), {"etag": etag})
+
+        with open(partial_path, mode) as f:
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                hasher.update(chunk)
+                downloaded_size += len(chunk)
+                metrics.incr("archive_bytes_downloaded", len(chunk))
+                if total_size > 0:
+                    progress = (downloaded_size / total_size) * 100
+                    logging.debug(f"Downloading '{asset_name}'... {progress:.2f}% complete")
+                else:
+                    logging.debug(f"Downloading '{asset_name}'... {downloaded_size / (1024 * 1024):.2f} MB downloaded")
+
+    sha256 = hasher.hexdigest()
+    if expected_sha256 and sha256 != expected_sha256:
+        logging.error(f"Checksum mismatch for '{asset_name}': expected {expected_sha256}, got {sha256}")
+        _remove_partial(asset_id)
+        return None
+
+    archive_path = _archive_path(sha256)
+    os.replace(partial_path, archive_path)
+    _remove_partial(asset_id)
+    _save_json(_metadata_path(asset_id), {
+        "asset_name": asset_name,
+        "url": download_url,
+        "etag": etag,
+        "sha256": sha256,
+        "size": downloaded_size
+    })
+    logging.info(f"Downloaded cache: {asset_name}")
+    return archive_path
+
+def _parse_sha256_digest(digest):
+    if digest and digest.startswith("sha256:"):
+        return digest[len("sha256:"):]
     return None
 
+def _archive_path(sha256):
+    return os.path.join(ARCHIVES_DIR, f"{sha256}.tar.gz")
+
+def _metadata_path(asset_id):
+    return os.path.join(DOWNLOADS_DIR, f"{asset_id}.json")
+
+def _partial_etag_path(asset_id):
+    return os.path.join(DOWNLOADS_DIR, f"{asset_id}.part.json")
+
+def _load_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def _save_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _load_download_metadata(asset_id):
+    return _load_json(_metadata_path(asset_id))
+
+def _load_partial_etag(asset_id):
+    data = _load_json(_partial_etag_path(asset_id))
+    return data.get("etag") if data else None
+
+def _remove_partial(asset_id):
+    for path in [os.path.join(DOWNLOADS_DIR, f"{asset_id}.part"), _partial_etag_path(asset_id)]:
+        if os.path.exists(path):
+            os.remove(path)
+            logging.debug(f"Removed partially downloaded file: '{path}'")
+
+def _prune_archives():
+    archives = [os.path.join(ARCHIVES_DIR, name) for name in os.listdir(ARCHIVES_DIR) if name.endswith('.tar.gz')]
+    archives.sort(key=os.path.getmtime, reverse=True)
+    for path in archives[CACHE_KEEP_ARCHIVES:]:
+        try:
+            os.remove(path)
+            logging.debug(f"Pruned cached archive: {path}")
+        except OSError as e:
+            logging.error(f"Error pruning cached archive '{path}': {e}")
+
 def extract_specific_folders_tarfile(file_path, extract_path, folders_to_extract):
     os.makedirs(extract_path, exist_ok=True)
     extracted_something = False
@@ -103,20 +263,10 @@ def extract_specific_folders_tarfile(file_path, extract_path, folders_to_extract
     return extracted_something
 
 def delete_files():
-    for dirname in ['dump', 'images']:
+    for dirname in ['dump']:
         if os.path.isdir(dirname):
             try:
                 shutil.rmtree(dirname)
                 logging.debug(f"Deleted directory: {dirname}")
             except Exception as e:
                 logging.error(f"Error deleting directory '{dirname}': {e}")
-
-    for filename in os.listdir('.'):
-        if filename.endswith('.tar.gz'):
-            try:
-                os.remove(filename)
-                logging.debug(f"Deleted file: {filename}")
-                break
-            except Exception as e:
-                logging.error(f"Error deleting file {filename}: {e}")
-
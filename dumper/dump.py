@@ -1,10 +1,12 @@
-﻿import json
+﻿import logging
+import math
 import os
-import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterator, NamedTuple, Optional
 
-from typing import Any
-
-import requests
+from cache_source import CacheSource, CacheStore, DirectoryCacheSource, get_json_loads, JSON_DECODER
+import metrics
+from item_names import ItemNames, load_item_names
 
 enums = [
     {
@@ -34,49 +36,74 @@ enums = [
     },
 ]
 
-item_names_dict = {}
+CATEGORY_ENUM_IDS = [enum["id"] for enum in enums]
+ITEM_REPLACEMENTS_ENUM_ID = 3721
+SUBCATEGORY_NAME_PARAM = '689'
+ITEMS_ENUM_PARAM = '690'
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", 1))
+
+
+class CatalogueItem(NamedTuple):
+    item_id: int
+    item_name: Optional[str]
+    original_item_id: int
+    display_order: int
+
+
+class Subcategory(NamedTuple):
+    subcategory_id: int
+    name: str
+    category_id: int
+    items: tuple  # of CatalogueItem, in display order
+
+
+item_names = None
 item_replacements = {}
 
+# Parsed enums and structs. Falls back to the extracted dump folder when no cache has been loaded.
+cache_store = None
+
+def load_cache(source: CacheSource, preload: bool = True, json_decoder: str = JSON_DECODER) -> CacheStore:
+    """
+    Sets the cache the enums and structs are read from. Without preload the store stays lazy and keeps
+    its source, pruned to the files the catalogue is built from. Each subcategory's files are then parsed
+    as it is reached and evicted once it is built, or decoded by the parse workers.
+    """
+    global cache_store
+    json_loads = get_json_loads(json_decoder)
+    if preload:
+        cache_store = CacheStore.build(source, CATEGORY_ENUM_IDS, [ITEM_REPLACEMENTS_ENUM_ID], ITEMS_ENUM_PARAM, json_loads)
+    else:
+        cache_store = CacheStore(source, json_loads)
+        source.retain(cache_store.reachable(CATEGORY_ENUM_IDS, [ITEM_REPLACEMENTS_ENUM_ID], ITEMS_ENUM_PARAM))
+    return cache_store
+
+def get_cache_store() -> CacheStore:
+    global cache_store
+    if cache_store is None:
+        cache_store = CacheStore(DirectoryCacheSource('dump'))
+    return cache_store
+
 def get_enum_data(enum_id: int) -> list[tuple[Any, Any]]:
-    file_path = os.path.join('dump', 'enums', f'{enum_id}.json')
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-            return list(zip(data['keys'], data['intVals']))
-    except FileNotFoundError:
-        logging.error(f"Error: File not found at {file_path}")
-        return []
-    except json.JSONDecodeError as e:
-        logging.error(f"Error decoding JSON from {file_path}: {e}")
-        return []
-    except Exception as e:
-        logging.error(f"An unexpected error occurred: {e}")
+    data = get_cache_store().enum(enum_id)
+    if not data:
         return []
+    return list(zip(data['keys'], data['intVals']))
 
 def get_struct_data(struct_id: int) -> dict:
-    file_path = os.path.join('dump', 'structs', f'{struct_id}.json')
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-            params = data.get('params', {})
-            name = params.get('689')
-            items_enum = params.get('690')
-            return {
-                'name': name,
-                'items_enum': items_enum
-            }
-    except FileNotFoundError:
-        logging.error(f"Error: File not found at {file_path}")
-        return {}
-    except json.JSONDecodeError as e:
-        logging.error(f"Error decoding JSON from {file_path}: {e}")
-        return {}
-    except Exception as e:
-        logging.error(f"An unexpected error occurred: {e}")
+    data = get_cache_store().struct(struct_id)
+    if not data:
         return {}
+    params = data.get('params', {})
+    name = params.get(SUBCATEGORY_NAME_PARAM)
+    items_enum = params.get(ITEMS_ENUM_PARAM)
+    return {
+        'name': name,
+        'items_enum': items_enum
+    }
 
 def populate_item_replacements():
-    mappings = get_enum_data(3721)
+    mappings = get_enum_data(ITEM_REPLACEMENTS_ENUM_ID)
     if mappings:
         for (key, val) in mappings:
             if key is not None and val is not None:
@@ -84,31 +111,103 @@ def populate_item_replacements():
 
     return item_replacements
 
-def process_all_enums():
-    result = []
+def iter_subcategories(workers: int = None, json_decoder: str = JSON_DECODER, release: bool = False) -> Iterator[Subcategory]:
+    """
+    Yields the catalogue one subcategory at a time, in category enum order. With release, the cache, item
+    names and replacements are dropped once the last subcategory has been parsed, as nothing reads them after.
+    """
+    workers = PARSE_WORKERS if workers is None else workers
+    try:
+        if workers > 1:
+            subcategories = _iter_subcategories_parallel(workers, json_decoder)
+        else:
+            subcategories = _iter_subcategories_serial()
+        for subcategory in subcategories:
+            metrics.incr("subcategories_parsed")
+            yield subcategory
+    finally:
+        if release:
+            release_parse_state()
+
+def _iter_subcategories_serial():
+    for enum in enums:
+        yield from process_enum(enum, category_id=enum['category_id'])
+
+def process_all_enums(workers: int = None, json_decoder: str = JSON_DECODER) -> list:
+    return list(iter_subcategories(workers, json_decoder))
+
+def release_parse_state():
+    global cache_store, item_names
+    cache_store = None
+    if item_names is not None:
+        item_names.close()
+    item_names = None
+    item_replacements.clear()
+
+
+def _init_parse_worker(source, json_decoder, item_names_path, replacements):
+    global cache_store, item_names
+    cache_store = CacheStore(source, get_json_loads(json_decoder))
+    # The snapshot is memory mapped, so every worker shares the same pages
+    item_names = ItemNames(item_names_path) if item_names_path else None
+    item_replacements.clear()
+    item_replacements.update(replacements)
+
+
+def _process_struct_batch(category_id: int, struct_ids: list):
+    # A worker's counters never reach the parent's, so each batch hands back what it counted
+    metrics.reset()
+    subcategories = [result for result in (process_struct(struct_id, category_id) for struct_id in struct_ids) if result]
+    return subcategories, metrics.counters()
+
+
+def _iter_subcategories_parallel(workers: int, json_decoder: str):
+    """Fans struct batches out to a process pool. The output is identical to the serial path, order included."""
+    store = get_cache_store()
+    if store.source is None:
+        logging.warning("The cache store was preloaded and has no source to share, parsing serially")
+        yield from _iter_subcategories_serial()
+        return
+
+    batches = []
     for enum in enums:
         logging.debug(f"Processing Enum ID: {enum['id']}, Name: {enum['name']}, Category ID: {enum['category_id']}")
-        result.extend(process_enum(enum, category_id=enum['category_id']))
-    return result
+        data = get_enum_data(enum['id'])
+        if not data:
+            logging.warning(f"No data found for Enum ID: {enum['id']}")
+            continue
+        struct_ids = [struct_id for _, struct_id in data]
+        batch_size = max(1, math.ceil(len(struct_ids) / workers))
+        for start in range(0, len(struct_ids), batch_size):
+            batches.append((enum['category_id'], struct_ids[start:start + batch_size]))
+
+    item_names_path = item_names.path if item_names is not None else None
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_parse_worker,
+                             initargs=(store.source, json_decoder, item_names_path, dict(item_replacements))) as executor:
+        results = executor.map(_process_struct_batch, *zip(*batches)) if batches else []
+        for batch, counters in results:
+            for name, value in counters.items():
+                metrics.incr(name, value)
+            yield from batch
 
 
 def process_enum(enum: dict, category_id: int):
     enum_id = enum['id']
+    logging.debug(f"Processing Enum ID: {enum_id}, Name: {enum['name']}, Category ID: {category_id}")
     data = get_enum_data(enum_id)
     if not data:
         logging.warning(f"No data found for Enum ID: {enum_id}")
-        return []
+        return
 
-    result = []
     for index, struct_id in data:
         struct_result = process_struct(struct_id, category_id)
         if struct_result:
-            result.append(struct_result)
-    return result
+            yield struct_result
 
 
 def process_struct(struct_id: int, category_id: int):
     struct_data = get_struct_data(struct_id)
+    get_cache_store().evict('structs', struct_id)
     if not struct_data:
         logging.warning(f"No data found for struct ID: {struct_id}")
         return None
@@ -119,59 +218,29 @@ def process_struct(struct_id: int, category_id: int):
         logging.warning(f"No items enum found for struct ID: {struct_id}")
         return None
 
-    return process_items(subcategory_name, struct_id, items_enum, category_id)
+    subcategory = process_items(subcategory_name, struct_id, items_enum, category_id)
+    get_cache_store().evict('enums', items_enum)
+    return subcategory
 
 
-def process_items(subcategory_name: str, subcategory_id: int, items_enum: int, category_id: int):
+def process_items(subcategory_name: str, subcategory_id: int, items_enum: int, category_id: int) -> Subcategory:
     items = get_enum_data(items_enum)
     item_ids = [x[1] for x in items]
     final_items = []
 
     for i, item_id in enumerate(item_ids):
-        item_name = item_names_dict.get(item_id, None)
+        item_name = item_names.get(item_id) if item_names is not None else None
         final_item_id = item_replacements.get(item_id, item_id)
         if item_id in item_replacements:
             logging.debug(f"Replaced item ID {item_id} with {final_item_id}")
 
-        final_item = {
-            "itemId": final_item_id,
-            "itemName": item_name if item_name else None,
-            "originalItemId": item_id,
-            "displayorder": i + 1
-        }
-        final_items.append(final_item)
+        final_items.append(CatalogueItem(final_item_id, item_name if item_name else None, item_id, i + 1))
 
-    return {
-        "subcategoryName": subcategory_name,
-        "subcategoryId": subcategory_id,
-        "items": final_items,
-        "categoryId": category_id
-    }
+    return Subcategory(subcategory_id, subcategory_name, category_id, tuple(final_items))
 
-def populate_item_dict() -> dict:
-    api_endpoint_url = "https://raw.githubusercontent.com/runelite/static.runelite.net/refs/heads/gh-pages/cache/item/names.json"
-
-    try:
-        response = requests.get(api_endpoint_url, timeout=30)
-        response.raise_for_status()
-        json_data = response.json()
-        for item_id, item_name in json_data.items():
-            item_names_dict[int(item_id)] = item_name
-
-        logging.debug(f"Item names dictionary populated with {len(item_names_dict)} items.")
-
-    except requests.exceptions.HTTPError as e:
-        logging.error(f"HTTP error occurred: {e} - Status code: {response.status_code}")
-    except requests.exceptions.ConnectionError as e:
-        logging.error(f"Connection error occurred: {e} - Check your internet connection or the URL.")
-    except requests.exceptions.Timeout as e:
-        logging.error(f"Request timed out: {e}")
-    except requests.exceptions.RequestException as e:
-        logging.error(f"An error occurred during the request: {e}")
-    except json.JSONDecodeError as e:
-        logging.error(f"Error decoding JSON response: {e}")
-        logging.error(f"Response content: {response.text[:200]}...") # Print first 200 chars for debugging
-    except Exception as e:
-        logging.error(f"An unexpected error occurred: {e}")
-
-    return item_names_dict
\ No newline at end of file
+def populate_item_names():
+    global item_names
+    item_names = load_item_names()
+    if item_names is not None:
+        logging.debug(f"Item names loaded with {len(item_names)} items.")
+    return item_names
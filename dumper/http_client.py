@@ -0,0 +1,138 @@
+import asyncio
+import functools
+import logging
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", 3))
+HTTP_RETRY_BACKOFF = float(os.environ.get("HTTP_RETRY_BACKOFF", 0.5))  # Seconds, doubled every attempt
+HTTP_MAX_BACKOFF = float(os.environ.get("HTTP_MAX_BACKOFF", 30))  # Seconds, also caps Retry-After
+HTTP_HOST_CONCURRENCY = int(os.environ.get("HTTP_HOST_CONCURRENCY", 8))  # Open connections per host
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 30))  # Seconds
+USER_AGENT = os.environ.get("HTTP_USER_AGENT", "clogged-dumper")
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header, which is either a number of seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def retry_delay(attempt: int, retry_after=None) -> float:
+    """Exponential backoff with full jitter, unless the server said how long to wait."""
+    if retry_after is not None:
+        return min(retry_after, HTTP_MAX_BACKOFF)
+    return random.uniform(0, min(HTTP_MAX_BACKOFF, HTTP_RETRY_BACKOFF * (2 ** attempt)))
+
+@functools.cache
+def get_session():
+    """
+    One keep-alive session per process. Each host gets a pool of HTTP_HOST_CONCURRENCY connections,
+    and callers beyond that wait for a free connection instead of opening more.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=HTTP_HOST_CONCURRENCY, pool_block=True, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+def request(method: str, url: str, **kwargs):
+    """
+    Sends a request through the shared session, retrying connection errors, timeouts, 429s and 5xxs.
+    Returns the last response, which may still be an error status. Raises requests' RequestException
+    if the last attempt could not connect at all.
+    """
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    for attempt in range(HTTP_RETRIES + 1):
+        retry_after = None
+        start = time.perf_counter()
+        try:
+            response = get_session().request(method, url, **kwargs)
+            metrics.observe(f"http_{method.lower()}", time.perf_counter() - start)
+            if response.status_code not in RETRY_STATUSES or attempt == HTTP_RETRIES:
+                return response
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            logging.debug(f"{method} {url} returned {response.status_code} (attempt {attempt + 1})")
+            response.close()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt == HTTP_RETRIES:
+                metrics.incr("http_request_failures")
+                raise
+            logging.debug(f"{method} {url} failed: {e} (attempt {attempt + 1})")
+
+        metrics.incr("http_retries")
+        time.sleep(retry_delay(attempt, retry_after))
+
+def get(url: str, **kwargs):
+    return request("GET", url, **kwargs)
+
+def put(url: str, **kwargs):
+    return request("PUT", url, **kwargs)
+
+class HostRateLimiter:
+    """Spaces out requests to each host so that no host sees more than `rate` requests per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._next_slot = {}
+        self._lock = asyncio.Lock()
+
+    async def wait(self, url: str):
+        if not self.interval:
+            return
+        host = urlparse(url).hostname
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+def async_session():
+    """An aiohttp session with the same keep-alive pooling and per-host connection cap as get_session()."""
+    connector = aiohttp.TCPConnector(limit_per_host=HTTP_HOST_CONCURRENCY, keepalive_timeout=30)
+    return aiohttp.ClientSession(connector=connector,
+                                 timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+                                 headers={"User-Agent": USER_AGENT})
+
+async def async_request(session, limiter, method: str, url: str):
+    """Returns (status, body) for a request, retrying like request(). Raises ConnectionError once out of attempts."""
+    for attempt in range(HTTP_RETRIES + 1):
+        await limiter.wait(url)
+        retry_after = None
+        start = time.perf_counter()
+        try:
+            async with session.request(method, url) as response:
+                if response.status not in RETRY_STATUSES:
+                    body = await response.read() if method == "GET" and response.status == 200 else None
+                    metrics.observe(f"http_{method.lower()}", time.perf_counter() - start)
+                    return response.status, body
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                logging.debug(f"{method} {url} returned {response.status} (attempt {attempt + 1})")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.debug(f"{method} {url} failed: {e} (attempt {attempt + 1})")
+
+        if attempt < HTTP_RETRIES:
+            metrics.incr("http_retries")
+            await asyncio.sleep(retry_delay(attempt, retry_after))
+
+    metrics.incr("http_request_failures")
+    raise ConnectionError(f"{method} {url} failed after {HTTP_RETRIES + 1} attempts")
@@ -0,0 +1,64 @@
+import io
+import logging
+import os
+
+from PIL import Image
+
+IMAGE_OPTIMIZE = os.environ.get("IMAGE_OPTIMIZE", "true").lower() == "true"
+IMAGE_WEBP_2X = os.environ.get("IMAGE_WEBP_2X", "false").lower() == "true"
+
+# Variant name -> (key suffix, content type). "png" is the sprite itself at items/{id}.png
+VARIANTS = {
+    "png": (".png", "image/png"),
+    "webp": (".webp", "image/webp"),
+    "webp_2x": ("@2x.webp", "image/webp"),
+}
+# Variant name -> subcategory_items column its URL is stored in
+VARIANT_COLUMNS = {
+    "png": "image_url",
+    "webp": "image_webp_url",
+    "webp_2x": "image_webp_2x_url",
+}
+
+
+def variant_key(item_id, variant: str) -> str:
+    return f"items/{item_id}{VARIANTS[variant][0]}"
+
+
+def optimize_png(data: bytes) -> bytes:
+    """Losslessly recompresses a PNG, returning the original bytes if that isn't any smaller."""
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        output = io.BytesIO()
+        # Drops ancillary chunks (text, timestamps) and retries the deflate with the best settings
+        image.save(output, format="PNG", optimize=True)
+    optimized = output.getvalue()
+    return optimized if len(optimized) < len(data) else data
+
+
+def _encode_webp(image) -> bytes:
+    output = io.BytesIO()
+    image.save(output, format="WEBP", lossless=True, quality=100, method=6, exact=True)
+    return output.getvalue()
+
+
+def encode_variants(data: bytes, include_2x: bool = None) -> dict:
+    """
+    Returns {variant: bytes} for a sprite PNG: the recompressed PNG, a lossless WebP and, if enabled,
+    a 2x WebP for hi-DPI screens. Returns just the original PNG if the variants can't be encoded.
+    """
+    if include_2x is None:
+        include_2x = IMAGE_WEBP_2X
+    try:
+        variants = {"png": optimize_png(data) if IMAGE_OPTIMIZE else data}
+        with Image.open(io.BytesIO(data)) as image:
+            image = image.convert("RGBA")
+            variants["webp"] = _encode_webp(image)
+            if include_2x:
+                # Nearest neighbour keeps the pixel art crisp instead of blurring it
+                upscaled = image.resize((image.width * 2, image.height * 2), Image.Resampling.NEAREST)
+                variants["webp_2x"] = _encode_webp(upscaled)
+        return variants
+    except (OSError, ValueError) as e:
+        logging.error(f"Could not encode image variants, keeping the original PNG: {e}")
+        return {"png": data}
@@ -1,79 +1,180 @@
-﻿import logging
+﻿import asyncio
+import base64
+import functools
+import hashlib
+import logging
 import os
-import shutil
 
 import boto3
-import requests
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+import metrics
+from http_client import HTTP_RETRIES, HostRateLimiter, async_request, async_session
+from image_variants import VARIANTS, encode_variants, variant_key
 
 access_key_id = os.environ.get("B2_ACCESS_KEY_ID")
 secret_access_key = os.environ.get("B2_SECRET_ACCESS_KEY")
 image_bucket_name = os.environ.get("B2_IMAGES_BUCKET_NAME")
 endpoint = os.environ.get("B2_ENDPOINT")
+# Overrides for pointing the image stage at other S3/sprite hosts, e.g. the local stand-ins in benchmark.py
+endpoint_url = os.environ.get("B2_ENDPOINT_URL") or f"https://{endpoint}"
+addressing_style = os.environ.get("B2_ADDRESSING_STYLE", "auto")
+SPRITE_BASE_URL = os.environ.get("SPRITE_BASE_URL", "https://chisel.weirdgloop.org/static/img/osrs-sprite")
+
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", 8))
+IMAGE_HOST_RATE_LIMIT = float(os.environ.get("IMAGE_HOST_RATE_LIMIT", 10))  # Requests per second per host
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+def get_public_object_url(key):
+    return f"https://{image_bucket_name}.{endpoint}/{key}"
 
 def get_public_url(file_name):
-    return f"https://{image_bucket_name}.{endpoint}/items/{file_name}"
+    return get_public_object_url(f"items/{file_name}")
 
+@functools.cache
 def get_b2_client():
-    b2_client = boto3.resource(service_name='s3',
-                             endpoint_url="https://" + endpoint,  # Backblaze endpoint
+    """One pooled client per process. boto3 clients are thread safe, unlike resources."""
+    b2_client = boto3.client(service_name='s3',
+                             endpoint_url=endpoint_url,  # Backblaze endpoint
                              aws_access_key_id=access_key_id,  # Backblaze keyID
-                             aws_secret_access_key=secret_access_key)  # Backblaze applicationKey
+                             aws_secret_access_key=secret_access_key,  # Backblaze applicationKey
+                             config=Config(max_pool_connections=max(IMAGE_WORKERS, 10),
+                                           s3={"addressing_style": addressing_style},
+                                           # Jittered exponential backoff on throttling and 5xxs, like http_client
+                                           retries={"mode": "standard", "max_attempts": HTTP_RETRIES + 1}))
     return b2_client
 
-def check_img_exists(file_name):
+def list_existing_images():
+    """Returns the file names of every sprite under items/ in the bucket, or None if the bucket can't be listed."""
+    existing = set()
     try:
-        response = requests.head(get_public_url(file_name), timeout=10)
-        return response.status_code == 200
-    except requests.exceptions.RequestException:
-        return False
+        paginator = get_b2_client().get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=image_bucket_name, Prefix='items/'):
+            for obj in page.get('Contents', []):
+                existing.add(obj['Key'][len('items/'):])
+    except (ClientError, BotoCoreError) as e:
+        logging.error(f"Failed to list images in B2, falling back to per-image checks: {e}")
+        return None
 
-def download_image(item_id):
-    url = f"https://chisel.weirdgloop.org/static/img/osrs-sprite/{item_id}.png"
-    asset_name = f"images/{item_id}.png"
-    if check_img_exists(f"{item_id}.png"):
-        logging.debug(f"Image for item ID {item_id} already exists in B2")
-        return get_public_url(f"{item_id}.png")
+    logging.debug(f"Found {len(existing)} images in B2")
+    return existing
 
-    os.makedirs(os.path.dirname(asset_name), exist_ok=True)
+async def check_img_exists(session, limiter, file_name):
+    status, _ = await async_request(session, limiter, "HEAD", get_public_url(file_name))
+    return status == 200
 
+async def download_image(session, limiter, item_id, existing_images=None):
+    url = f"{SPRITE_BASE_URL}/{item_id}.png"
     try:
-        response = requests.get(url, stream=True, timeout=30)
-        response.raise_for_status()  # Raise an error for bad responses
-        with open(asset_name, 'wb') as out_file:
-            shutil.copyfileobj(response.raw, out_file)
-        logging.debug(f"Downloaded image for item ID {item_id} to {asset_name}")
-        upload_response = upload_file("images", f"{item_id}.png", get_b2_client(), f"items/{item_id}.png")
+        if existing_images is not None:
+            exists = f"{item_id}.png" in existing_images
+        else:
+            exists = await check_img_exists(session, limiter, f"{item_id}.png")
+        if exists:
+            logging.debug(f"Image for item ID {item_id} already exists in B2")
+            return existing_variant_urls(item_id, existing_images)
+
+        status, body = await async_request(session, limiter, "GET", url)
+        if status != 200:
+            logging.error(f"Error downloading image for item ID {item_id}: HTTP {status}")
+            return None
+
+        if not body.startswith(PNG_SIGNATURE):
+            logging.error(f"Downloaded image for item ID {item_id} is not a PNG, skipping upload")
+            return None
+        logging.debug(f"Downloaded image for item ID {item_id} ({len(body)} bytes)")
+
+        # Pillow and boto3 are blocking, keep them off the event loop
+        variant_urls = await asyncio.to_thread(upload_sprite, item_id, body)
         logging.debug(f"Uploaded image for item ID {item_id} to B2")
-        return upload_response
-
-    except requests.exceptions.RequestException as e:
-        logging.error(f"\nError during download request: {e}")
-        if os.path.exists(asset_name):  # Clean up
-            os.remove(asset_name)
-            logging.error(f"Removed partially downloaded file: '{asset_name}'")
-    except IOError as e:
-        logging.error(f"\nError writing file to disk: {e}")
-        if os.path.exists(asset_name):  # Clean up
-            os.remove(asset_name)
-            logging.error(f"Removed partially downloaded file: '{asset_name}'")
+        return variant_urls
+
+    except ConnectionError as e:
+        logging.error(f"Error during download request: {e}")
+
+    return None
+
+async def _download_images(jobs: list) -> list:
+    existing_images = await asyncio.to_thread(list_existing_images)
+    semaphore = asyncio.Semaphore(IMAGE_WORKERS)
+    limiter = HostRateLimiter(IMAGE_HOST_RATE_LIMIT)
+
+    async with async_session() as session:
+        async def worker(item_id):
+            async with semaphore:
+                return await download_image(session, limiter, item_id, existing_images)
+
+        results = await asyncio.gather(*(worker(item_id) for item_id in jobs), return_exceptions=True)
+
+    for item_id, result in zip(jobs, results):
+        if isinstance(result, Exception):
+            logging.error(f"Error resolving image for item ID {item_id}: {result}")
+    return [None if isinstance(result, Exception) else result for result in results]
+
+def download_images(item_ids: list) -> list:
+    """
+    Resolves the B2 URLs of every item's sprite variants, fetching and uploading missing ones with bounded
+    concurrency. Returns {variant: url} dicts in the same order as item_ids, None where an image could not
+    be resolved.
+    """
+    if not item_ids:
+        return []
+    return asyncio.run(_download_images(item_ids))
+
+def put_object(data: bytes, key: str, content_type: str, cache_control: str = None):
+    """Uploads in-memory bytes. B2 verifies the body against its MD5, and the SHA-256 is stored as metadata."""
+    extra_args = {"CacheControl": cache_control} if cache_control else {}
+    try:
+        logging.debug(f"Uploading {len(data)} bytes to {key}")
+        with metrics.timed("image_upload"):
+            get_b2_client().put_object(Bucket=image_bucket_name,
+                                       Key=key,
+                                       Body=data,
+                                       ContentType=content_type,
+                                       ContentMD5=base64.b64encode(hashlib.md5(data).digest()).decode("ascii"),
+                                       Metadata={"sha256": hashlib.sha256(data).hexdigest()},
+                                       **extra_args)
+        logging.debug(f"Uploaded {key}")
+        return get_public_object_url(key)
+    except (ClientError, BotoCoreError) as e:
+        logging.error(f"Failed to upload {key} to B2: {e}")
 
     return None
 
-def upload_file(directory, file, b2, b2path=None):
-    file_path = os.path.join(directory, file)
+def upload_bytes(data: bytes, file, b2path=None):
     remote_path = b2path
     if remote_path is None:
-        remote_path = file
-    try:
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File {file_path} does not exist.")
+        remote_path = f"items/{file}"
+    public_url = put_object(data, remote_path, "image/png")
+    if public_url:
+        metrics.incr("images_uploaded")
+    return public_url
 
-        logging.debug(f"Uploading {file} to {remote_path}")
-        response = b2.Bucket(image_bucket_name).upload_file(file_path, remote_path)
-        logging.debug(f"Uploaded {file} to {remote_path}")
-        return get_public_url(file)
-    except ClientError as ce:
-        logging.error(f"Failed to upload {file} to B2: {ce}")
+def existing_variant_urls(item_id, existing_images=None) -> dict:
+    """URLs of the variants already in the bucket. Without a listing only the PNG is known to exist."""
+    if existing_images is None:
+        return {"png": get_public_url(f"{item_id}.png")}
+    return {variant: get_public_object_url(variant_key(item_id, variant))
+            for variant in VARIANTS
+            if variant_key(item_id, variant)[len("items/"):] in existing_images}
 
-    return None
\ No newline at end of file
+def upload_sprite(item_id, data: bytes, variants: dict = None):
+    """
+    Uploads a sprite's optimized variants, encoding them from data unless given. Returns {variant: url},
+    or None if the PNG could not be uploaded. Other variants that fail are left out for the backfill.
+    """
+    if variants is None:
+        variants = encode_variants(data)
+    variant_urls = {}
+    for variant, body in variants.items():
+        public_url = put_object(body, variant_key(item_id, variant), VARIANTS[variant][1])
+        if public_url:
+            variant_urls[variant] = public_url
+            metrics.incr("images_uploaded")
+        elif variant == "png":
+            return None
+    if "png" in variants:
+        metrics.incr("image_bytes_saved", len(data) - len(variants["png"]))
+    return variant_urls
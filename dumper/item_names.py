@@ -0,0 +1,168 @@
+import json
+import logging
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+
+import requests
+
+import http_client
+import metrics
+
+from download_cache import CACHE_DIR
+
+ITEM_NAMES_URL = os.environ.get(
+    "ITEM_NAMES_URL",
+    "https://raw.githubusercontent.com/runelite/static.runelite.net/refs/heads/gh-pages/cache/item/names.json")
+SNAPSHOT_PATH = os.path.join(CACHE_DIR, "item_names.bin")
+METADATA_PATH = os.path.join(CACHE_DIR, "item_names.json")
+
+# Snapshot layout: header, sorted int32 item ids, uint32 name offsets (count + 1), UTF-8 names blob
+SNAPSHOT_MAGIC = b"ITMN"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<4sII")
+
+
+class ItemNames:
+    """Item id to name lookups over a memory-mapped snapshot, without loading it into a dict."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mmap) < SNAPSHOT_HEADER.size:
+            self._mmap.close()
+            raise ValueError(f"{path} is truncated")
+        magic, version, count = SNAPSHOT_HEADER.unpack_from(self._mmap, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            self._mmap.close()
+            raise ValueError(f"{path} is not an item names snapshot")
+
+        ids_start = SNAPSHOT_HEADER.size
+        offsets_start = ids_start + 4 * count
+        self._names_start = offsets_start + 4 * (count + 1)
+        # The last offset is where the names blob ends
+        if (len(self._mmap) < self._names_start or
+                len(self._mmap) < self._names_start + struct.unpack_from("<I", self._mmap, self._names_start - 4)[0]):
+            self._mmap.close()
+            raise ValueError(f"{path} is truncated")
+
+        view = memoryview(self._mmap)
+        self._ids = view[ids_start:offsets_start].cast('i')
+        self._offsets = view[offsets_start:self._names_start].cast('I')
+
+    def get(self, item_id: int, default=None):
+        index = bisect_left(self._ids, item_id)
+        if index == len(self._ids) or self._ids[index] != item_id:
+            return default
+        start = self._names_start + self._offsets[index]
+        end = self._names_start + self._offsets[index + 1]
+        return self._mmap[start:end].decode('utf-8')
+
+    def __len__(self):
+        return len(self._ids)
+
+    def close(self):
+        # The views into the mapping have to go before it can be unmapped
+        self._ids.release()
+        self._offsets.release()
+        self._mmap.close()
+
+
+def write_snapshot(path: str, names: dict):
+    ids = array('i')
+    offsets = array('I', [0])
+    blob = bytearray()
+    for item_id in sorted(names):
+        ids.append(item_id)
+        blob += names[item_id].encode('utf-8')
+        offsets.append(len(blob))
+
+    if ids.itemsize != 4 or offsets.itemsize != 4:
+        raise RuntimeError("Unsupported platform for item name snapshots")
+    if struct.pack('=I', 1) != struct.pack('<I', 1):
+        ids.byteswap()
+        offsets.byteswap()
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(ids)))
+        ids.tofile(file)
+        offsets.tofile(file)
+        file.write(blob)
+    os.replace(tmp_path, path)
+
+
+def _open_snapshot():
+    try:
+        return ItemNames(SNAPSHOT_PATH)
+    except (OSError, ValueError) as e:
+        logging.error(f"Could not open item names snapshot {SNAPSHOT_PATH}: {e}")
+        return None
+
+
+def load_item_names():
+    """
+    Returns the RuneLite item names, revalidating the local snapshot with ETag/Last-Modified.
+    Falls back to the last good snapshot if the fetch fails, and returns None only if there is none.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    snapshot = _open_snapshot() if os.path.exists(SNAPSHOT_PATH) else None
+    metadata = {}
+    if snapshot is not None:
+        try:
+            with open(METADATA_PATH, 'r', encoding='utf-8') as file:
+                metadata = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            metadata = {}
+    else:
+        # Without a readable snapshot a 304 would leave nothing to use, so fetch the names unconditionally
+        try:
+            os.remove(METADATA_PATH)
+        except FileNotFoundError:
+            pass
+
+    headers = {}
+    if metadata.get("etag"):
+        headers["If-None-Match"] = metadata["etag"]
+    if metadata.get("last_modified"):
+        headers["If-Modified-Since"] = metadata["last_modified"]
+
+    try:
+        response = http_client.get(ITEM_NAMES_URL, headers=headers)
+        if response.status_code == 304 and snapshot is not None:
+            logging.debug("Item names not modified, using the local snapshot.")
+            return snapshot
+        response.raise_for_status()
+        metrics.incr("item_names_bytes_downloaded", len(response.content))
+        names = {int(item_id): item_name for item_id, item_name in response.json().items()}
+    except (requests.exceptions.RequestException, ValueError) as e:
+        if snapshot is not None:
+            logging.warning(f"Could not fetch item names ({e}), using the last good snapshot.")
+            return snapshot
+        logging.error(f"Could not fetch item names and no snapshot is available: {e}")
+        return None
+
+    try:
+        write_snapshot(SNAPSHOT_PATH, names)
+        tmp_path = f"{METADATA_PATH}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified")
+            }, file)
+        os.replace(tmp_path, METADATA_PATH)
+    except OSError as e:
+        if snapshot is not None:
+            logging.warning(f"Could not write the item names snapshot ({e}), using the last good snapshot.")
+            return snapshot
+        logging.error(f"Could not write the item names snapshot and no snapshot is available: {e}")
+        return None
+    logging.debug(f"Item names snapshot written with {len(names)} items.")
+
+    if snapshot is not None:
+        snapshot.close()
+    return _open_snapshot()
@@ -1,24 +1,121 @@
+import argparse
 import logging
 
-from db import update_db
-from download_cache import download_latest_cache, extract_specific_folders_tarfile, delete_files
-from dump import populate_item_replacements, process_all_enums, populate_item_dict
+import metrics
+from daemon import run_daemon, DAEMON_POLL_INTERVAL, DAEMON_HEALTH_PORT
+from plan import plan_db, write_plan
+from db import update_db, get_last_release_fingerprint, record_release_fingerprint, get_db_targets, target_name
+from download_cache import fetch_latest_release, get_release_fingerprint, download_latest_cache, \
+    extract_specific_folders_tarfile, delete_files
+from cache_source import DirectoryCacheSource, TarballCacheSource, JSON_DECODER
+from dump import populate_item_replacements, iter_subcategories, process_all_enums, populate_item_names, load_cache, \
+    ITEMS_ENUM_PARAM, PARSE_WORKERS
+
+
+def run(args) -> int:
+    with metrics.stage("release_check"):
+        release = fetch_latest_release()
+        if not release:
+            logging.error("Failed to fetch the latest cache release.")
+            return 1
+
+        fingerprint = get_release_fingerprint(release)
+        targets = get_db_targets(args.target)
+        if not args.force and not args.plan:
+            targets = [dsn for dsn in targets if fingerprint != get_last_release_fingerprint(dsn)]
+        if not targets:
+            logging.info(f"Cache release {fingerprint['tag']} has already been applied, nothing to do.")
+            return 0
+
+    with metrics.stage("download"):
+        archive_path = download_latest_cache(release)
+    if not archive_path:
+        logging.error("Failed to download the latest cache.")
+        return 1
+
+    with metrics.stage("read_cache"):
+        # Nothing is parsed up front: subcategories are parsed as the load pulls them and evicted once built
+        if args.extract:
+            extract_specific_folders_tarfile(archive_path, '.', ['dump/enums', 'dump/structs'])
+            load_cache(DirectoryCacheSource('dump'), False, args.json_decoder)
+        else:
+            load_cache(TarballCacheSource(archive_path, ITEMS_ENUM_PARAM), False, args.json_decoder)
+
+    with metrics.stage("item_names"):
+        populate_item_replacements()
+        item_names = populate_item_names()
+    if item_names is None:
+        logging.error("No item names are available, not writing a catalogue without names.")
+        return 1
+
+    if args.plan:
+        with metrics.stage("process_enums"):
+            dump = process_all_enums(args.parse_workers, args.json_decoder)
+        logging.info(f"Processed {len(dump)} subcategories from cache")
+        with metrics.stage("plan"):
+            plans = {target_name(dsn): plan_db(dump, dsn) for dsn in targets}
+        if any(plan is None for plan in plans.values()):
+            return 1
+        write_plan(plans.popitem()[1] if len(plans) == 1 else plans, args.plan_output)
+        return 0
+
+    # The parse streams straight into the load, so this stage includes processing the enums
+    with metrics.stage("update_db"):
+        subcategories = iter_subcategories(args.parse_workers, args.json_decoder, release=True)
+        results = update_db(subcategories, force=args.force, dsns=targets, release_tag=fingerprint["tag"])
+
+    for dsn in targets:
+        if results.get(target_name(dsn)):
+            record_release_fingerprint(fingerprint, dsn)
+    failed = [name for name, result in results.items() if not result]
+    if failed:
+        logging.error(f"Database update did not complete for {', '.join(failed)}, "
+                      "the release will be retried there on the next run.")
+        return 1
+    return 0
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the collection log structure from the latest OSRS cache.")
+    parser.add_argument("--force", action="store_true",
+                        help="Run even if the latest cache release has already been applied, "
+                             "and re-merge subcategories whose content digest is unchanged.")
+    parser.add_argument("--extract", action="store_true",
+                        help="Extract the enums and structs to disk instead of reading them from the archive in memory.")
+    parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS, metavar="N",
+                        help="Parse the category enums with a pool of N processes (default: PARSE_WORKERS or 1).")
+    parser.add_argument("--json-decoder", choices=["json", "orjson"], default=JSON_DECODER,
+                        help="JSON decoder for the cache files. orjson is used only if it is installed.")
+    parser.add_argument("--plan", action="store_true",
+                        help="Print the changes the latest cache would make to the catalogue as JSON, without writing anything.")
+    parser.add_argument("--plan-output", metavar="PATH",
+                        help="With --plan, write the JSON plan to PATH instead of stdout.")
+    parser.add_argument("--target", action="append", metavar="DSN",
+                        help="Load this database instead of the DB_* one. Repeat to load several from one parse "
+                             "(default: DB_TARGETS).")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Keep running and load each new cache release as soon as it is published.")
+    parser.add_argument("--poll-interval", type=float, default=DAEMON_POLL_INTERVAL, metavar="SECONDS",
+                        help="With --daemon, seconds between release checks (default: DAEMON_POLL_INTERVAL or 300).")
+    parser.add_argument("--health-port", type=int, default=DAEMON_HEALTH_PORT, metavar="PORT",
+                        help="With --daemon, serve /healthz and /metrics on PORT, 0 to disable "
+                             "(default: DAEMON_HEALTH_PORT or 8080).")
+    args = parser.parse_args()
+    if args.daemon and (args.force or args.plan):
+        parser.error("--daemon can't be combined with --force or --plan")
+
     logging.basicConfig(level=logging.INFO)
     logging.info("Dumper starting...")
 
-    asset_name = download_latest_cache()
-    if not asset_name:
-        logging.error("Failed to download the latest cache.")
-        exit(1)
-
-    extract_specific_folders_tarfile(asset_name, '.', ['dump/enums', 'dump/structs'])
+    if args.daemon:
+        exit(run_daemon(lambda: run(args), args.poll_interval, args.health_port))
 
-    populate_item_replacements()
-    populate_item_dict()
+    exit_code = 1
+    try:
+        exit_code = run(args)
+    finally:
+        with metrics.stage("cleanup"):
+            delete_files()
+        metrics.export(exit_code == 0)
 
-    dump = process_all_enums()
-    logging.info(f"Processed {len(dump)} subcategories from cache")
-    update_db(dump)
-    delete_files()
+    exit(exit_code)
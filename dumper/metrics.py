@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import requests
+
+METRICS_REPORT_PATH = os.environ.get("METRICS_REPORT_PATH")  # JSON run report
+METRICS_TEXTFILE_PATH = os.environ.get("METRICS_TEXTFILE_PATH")  # Prometheus node_exporter textfile
+METRICS_PUSHGATEWAY_URL = os.environ.get("METRICS_PUSHGATEWAY_URL")
+METRICS_JOB = os.environ.get("METRICS_JOB", "clogged_dumper")
+METRICS_PREFIX = "clogged_dumper"
+
+_lock = threading.Lock()
+_run_started = time.time()
+_stages = {}
+_counters = {}
+_timings = {}
+
+# Report lines are plain JSON so Loki can parse them with `| json`
+_metrics_logger = logging.getLogger("metrics")
+_metrics_handler = logging.StreamHandler()
+_metrics_handler.setFormatter(logging.Formatter("%(message)s"))
+_metrics_logger.addHandler(_metrics_handler)
+_metrics_logger.propagate = False
+_metrics_logger.setLevel(logging.INFO)
+
+
+def reset():
+    global _run_started
+    with _lock:
+        _run_started = time.time()
+        _stages.clear()
+        _counters.clear()
+        _timings.clear()
+
+
+@contextmanager
+def stage(name: str):
+    """Records the wall-clock and CPU time of a pipeline stage."""
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        with _lock:
+            entry = _stages.setdefault(name, {"wall_seconds": 0.0, "cpu_seconds": 0.0})
+            entry["wall_seconds"] += wall
+            entry["cpu_seconds"] += cpu
+        logging.debug(f"Stage {name} took {wall:.3f}s ({cpu:.3f}s CPU)")
+
+
+def incr(name: str, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def counters() -> dict:
+    with _lock:
+        return dict(_counters)
+
+
+def observe(name: str, seconds: float):
+    """Records one latency sample, e.g. a SQL statement or an image fetch."""
+    with _lock:
+        entry = _timings.setdefault(name, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        entry["count"] += 1
+        entry["total_seconds"] += seconds
+        entry["max_seconds"] = max(entry["max_seconds"], seconds)
+
+
+@contextmanager
+def timed(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def report(success: bool = True) -> dict:
+    with _lock:
+        return {
+            "run_started": datetime.fromtimestamp(_run_started, timezone.utc).isoformat(),
+            "duration_seconds": round(time.time() - _run_started, 3),
+            "success": success,
+            "stages": {name: dict(entry) for name, entry in _stages.items()},
+            "counters": dict(_counters),
+            "timings": {name: dict(entry) for name, entry in _timings.items()},
+        }
+
+
+def to_prometheus(run_report: dict) -> str:
+    lines = [
+        f"# TYPE {METRICS_PREFIX}_last_run_timestamp_seconds gauge",
+        f"{METRICS_PREFIX}_last_run_timestamp_seconds {time.time():.0f}",
+        f"# TYPE {METRICS_PREFIX}_last_run_success gauge",
+        f"{METRICS_PREFIX}_last_run_success {1 if run_report['success'] else 0}",
+        f"# TYPE {METRICS_PREFIX}_run_duration_seconds gauge",
+        f"{METRICS_PREFIX}_run_duration_seconds {run_report['duration_seconds']}",
+    ]
+    for key in ["wall_seconds", "cpu_seconds"]:
+        lines.append(f"# TYPE {METRICS_PREFIX}_stage_{key} gauge")
+        for name, entry in run_report["stages"].items():
+            lines.append(f'{METRICS_PREFIX}_stage_{key}{{stage="{name}"}} {entry[key]:.6f}')
+    for name, value in run_report["counters"].items():
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name} gauge")
+        lines.append(f"{METRICS_PREFIX}_{name} {value}")
+    for name, entry in run_report["timings"].items():
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name}_seconds summary")
+        lines.append(f"{METRICS_PREFIX}_{name}_seconds_count {entry['count']}")
+        lines.append(f"{METRICS_PREFIX}_{name}_seconds_sum {entry['total_seconds']:.6f}")
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name}_seconds_max gauge")
+        lines.append(f"{METRICS_PREFIX}_{name}_seconds_max {entry['max_seconds']:.6f}")
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path: str, content: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+
+
+def export(success: bool) -> dict:
+    """Logs the run report as JSON lines and writes/pushes it to whichever outputs are configured."""
+    run_report = report(success)
+
+    for name, entry in run_report["stages"].items():
+        _metrics_logger.info(json.dumps({"msg": "dumper_stage", "stage": name, **entry}))
+    for name, entry in run_report["timings"].items():
+        _metrics_logger.info(json.dumps({"msg": "dumper_timing", "name": name, **entry}))
+    _metrics_logger.info(json.dumps({
+        "msg": "dumper_run",
+        "success": success,
+        "duration_seconds": run_report["duration_seconds"],
+        **run_report["counters"]
+    }))
+
+    try:
+        if METRICS_REPORT_PATH:
+            _write_atomic(METRICS_REPORT_PATH, json.dumps(run_report, indent=2))
+        if METRICS_TEXTFILE_PATH:
+            _write_atomic(METRICS_TEXTFILE_PATH, to_prometheus(run_report))
+    except OSError as e:
+        logging.error(f"Error writing metrics: {e}")
+
+    if METRICS_PUSHGATEWAY_URL:
+        try:
+            # http_client reports into this module, so it is only imported once it is needed
+            import http_client
+            response = http_client.put(f"{METRICS_PUSHGATEWAY_URL.rstrip('/')}/metrics/job/{METRICS_JOB}",
+                                       data=to_prometheus(run_report), timeout=10)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error pushing metrics to {METRICS_PUSHGATEWAY_URL}: {e}")
+
+    return run_report
@@ -0,0 +1,126 @@
+import json
+import logging
+
+import psycopg2
+
+from db import connect_db, release_db, target_name
+
+
+def read_catalogue(conn):
+    """Reads the current catalogue in a single query: ({subcategory_id: row}, {(subcategory_id, item_id): row})."""
+    sql = """
+        SELECT s.id, s.name, s.categoryid, si.itemid, si.itemname, si.originalitemid, si.displayorder, si.image_url
+        FROM subcategories s
+                 LEFT JOIN subcategory_items si ON si.subcategoryid = s.id;
+    """
+    subcategories = {}
+    items = {}
+    with conn.cursor() as cur:
+        cur.execute(sql)
+        for subcategory_id, name, category_id, item_id, item_name, original_item_id, display_order, image_url in cur:
+            subcategories[subcategory_id] = {"name": name, "categoryId": category_id}
+            if item_id is not None:
+                items[(subcategory_id, item_id)] = {
+                    "itemName": item_name,
+                    "originalItemId": original_item_id,
+                    "displayorder": display_order,
+                    "imageUrl": image_url
+                }
+    return subcategories, items
+
+
+def compute_plan(parsed_subcategories, subcategories: dict, items: dict) -> dict:
+    """Diffs the parsed subcategories against the current catalogue, the same way update_db would apply them."""
+    plan = {
+        "subcategories_added": [],
+        "subcategories_renamed": [],
+        "subcategories_moved": [],
+        "subcategories_not_in_cache": [],
+        "items_added": [],
+        "items_removed": [],
+        "items_renamed": [],
+        "items_reordered": [],
+        "missing_images": [],
+    }
+    known_images = {row["originalItemId"] for row in items.values() if row["imageUrl"]}
+    missing_images = set()
+    dumped_ids = set()
+    dumped_items = set()
+
+    for parsed in parsed_subcategories:
+        subcategory_id = parsed.subcategory_id
+        dumped_ids.add(subcategory_id)
+        current = subcategories.get(subcategory_id)
+        if current is None:
+            plan["subcategories_added"].append({"id": subcategory_id, "name": parsed.name, "categoryId": parsed.category_id})
+        else:
+            if current["name"] != parsed.name:
+                plan["subcategories_renamed"].append({"id": subcategory_id, "from": current["name"], "to": parsed.name})
+            if current["categoryId"] != parsed.category_id:
+                plan["subcategories_moved"].append({"id": subcategory_id, "name": parsed.name, "from": current["categoryId"], "to": parsed.category_id})
+
+        # Duplicate item ids keep their first position, like the staged merge
+        new_items = {}
+        for item in sorted(parsed.items, key=lambda item: item.display_order):
+            new_items.setdefault(item.item_id, item)
+            dumped_items.add((subcategory_id, item.item_id))
+
+        for item_id, item in new_items.items():
+            row = items.get((subcategory_id, item_id))
+            entry = {"subcategoryId": subcategory_id, "itemId": item_id}
+            if row is None:
+                plan["items_added"].append({**entry, "itemName": item.item_name})
+            else:
+                # The merge rewrites the row when either differs (IS DISTINCT FROM, so None equals None)
+                if (row["itemName"], row["originalItemId"]) != (item.item_name, item.original_item_id):
+                    plan["items_renamed"].append({**entry, "from": row["itemName"], "to": item.item_name,
+                                                  "fromOriginalItemId": row["originalItemId"],
+                                                  "toOriginalItemId": item.original_item_id})
+                if row["displayorder"] != item.display_order:
+                    plan["items_reordered"].append({**entry, "from": row["displayorder"], "to": item.display_order})
+            if item.original_item_id not in known_images:
+                missing_images.add(item.original_item_id)
+
+    for (subcategory_id, item_id), row in items.items():
+        if subcategory_id in dumped_ids and (subcategory_id, item_id) not in dumped_items:
+            plan["items_removed"].append({"subcategoryId": subcategory_id, "itemId": item_id, "itemName": row["itemName"]})
+
+    for subcategory_id, current in subcategories.items():
+        if subcategory_id not in dumped_ids:
+            plan["subcategories_not_in_cache"].append({"id": subcategory_id, "name": current["name"]})
+
+    plan["missing_images"] = sorted(missing_images)
+    plan["summary"] = {key: len(value) for key, value in plan.items()}
+    return plan
+
+
+def plan_db(parsed_subcategories, dsn: str = None):
+    """Computes what update_db would change without writing anything. Returns None if the database is unreachable."""
+    conn = connect_db(dsn)
+    if not conn:
+        logging.error("Could not establish database connection.")
+        return None
+
+    try:
+        # Read-only transaction: only ACCESS SHARE locks are taken
+        conn.set_session(readonly=True)
+        subcategories, items = read_catalogue(conn)
+        conn.rollback()
+    except psycopg2.Error as e:
+        logging.error(f"Database error while reading the catalogue: {e}")
+        return None
+    finally:
+        release_db(conn)
+
+    plan = compute_plan(parsed_subcategories, subcategories, items)
+    logging.info(f"Plan for {target_name(dsn)}: " + ", ".join(f"{count} {key.replace('_', ' ')}" for key, count in plan["summary"].items()))
+    return plan
+
+
+def write_plan(plan: dict, output_path: str = None):
+    content = json.dumps(plan, indent=2)
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as file:
+            file.write(content)
+    else:
+        print(content)
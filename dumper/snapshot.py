@@ -0,0 +1,134 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+import psycopg2
+
+import metrics
+from images import put_object
+
+CATALOGUE_SNAPSHOTS_ENABLED = os.environ.get("CATALOGUE_SNAPSHOTS_ENABLED", "true").lower() == "true"
+CATALOGUE_SNAPSHOTS_UPLOAD = os.environ.get("CATALOGUE_SNAPSHOTS_UPLOAD", "true").lower() == "true"
+CATALOGUE_NOTIFY_CHANNEL = "catalogue_snapshot"
+# Bump when the shape of the snapshot changes, consumers ignore formats they don't know
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+def read_catalogue_tree(conn) -> dict:
+    """
+    The static catalogue as the API serves it: categories by name, their subcategories by name, and each
+    subcategory's items in catalogue order, along with its sprite atlas if one has been built. Sorted by
+    the database so the order matches its collation.
+    Categories and subcategories without items are left out, like the API does. catalogueVersion is the
+    latest catalogue_versions id, so clients can fetch the changes made after it.
+    """
+    sql = """
+        SELECT c.id, c.name, s.id, s.name, s.atlas_png_url, s.atlas_webp_url, s.atlas_map_url,
+               si.itemid, si.originalitemid, si.itemname, si.image_url, si.image_webp_url, si.image_webp_2x_url
+        FROM subcategory_items si
+                 JOIN subcategories s ON s.id = si.subcategoryid
+                 JOIN categories c ON c.id = s.categoryid
+        ORDER BY c.name, s.name, si.id;
+    """
+    categories = []
+    with conn.cursor() as cur:
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM catalogue_versions;")
+        catalogue_version = cur.fetchone()[0]
+        cur.execute(sql)
+        for (category_id, category_name, subcategory_id, subcategory_name, atlas_url, atlas_webp_url, atlas_map_url,
+             item_id, original_item_id, item_name, image_url, image_webp_url, image_webp_2x_url) in cur:
+            if not categories or categories[-1]["id"] != category_id:
+                categories.append({"id": category_id, "name": category_name, "subcategories": []})
+            subcategories = categories[-1]["subcategories"]
+            if not subcategories or subcategories[-1]["id"] != subcategory_id:
+                subcategories.append({
+                    "id": subcategory_id,
+                    "name": subcategory_name,
+                    "atlasUrl": atlas_url,
+                    "atlasWebpUrl": atlas_webp_url,
+                    "atlasMapUrl": atlas_map_url,
+                    "items": [],
+                })
+            subcategories[-1]["items"].append({
+                "itemId": item_id,
+                "originalItemId": original_item_id,
+                "name": item_name,
+                "imageUrl": image_url,
+                "imageWebpUrl": image_webp_url,
+                "imageWebp2xUrl": image_webp_2x_url,
+            })
+    return {"formatVersion": SNAPSHOT_FORMAT_VERSION, "catalogueVersion": catalogue_version, "categories": categories}
+
+
+def encode_snapshot(catalogue: dict):
+    """Returns (canonical JSON bytes, sha256 hex of them, gzip of them). The same catalogue always gives the same bytes."""
+    content = json.dumps(catalogue, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    # mtime=0 keeps the gzip stream reproducible too
+    return content, hashlib.sha256(content).hexdigest(), gzip.compress(content, mtime=0)
+
+
+def publish_catalogue_snapshot(conn, uploaded_snapshots: dict = None):
+    """
+    Stores a snapshot of the catalogue in catalogue_snapshots, uploads it to B2 and notifies listeners on
+    the catalogue_snapshot channel, unless the latest snapshot already has the same content. Returns the
+    snapshot's version (its id), or None if it could not be published. uploaded_snapshots maps content
+    hashes to the URLs already uploaded this run, so several target databases share one upload.
+    """
+    if not CATALOGUE_SNAPSHOTS_ENABLED:
+        return None
+    if uploaded_snapshots is None:
+        uploaded_snapshots = {}
+
+    insert_sql = """
+        INSERT INTO catalogue_snapshots (content_hash, format_version, size_bytes, url, payload)
+        VALUES (%s, %s, %s, %s, %s::jsonb)
+        ON CONFLICT (content_hash) DO NOTHING
+        RETURNING id;
+    """
+
+    try:
+        with conn.cursor() as cur:
+            with metrics.timed("catalogue_snapshot_build"):
+                content, content_hash, compressed = encode_snapshot(read_catalogue_tree(conn))
+            cur.execute("SELECT id FROM catalogue_snapshots WHERE content_hash = %s;", (content_hash,))
+            existing = cur.fetchone()
+        conn.rollback()
+    except psycopg2.Error as e:
+        logging.error(f"Database error while reading the catalogue for a snapshot: {e}")
+        conn.rollback()
+        return None
+
+    if existing:
+        logging.debug(f"Catalogue snapshot {content_hash[:16]} is already published as version {existing[0]}")
+        return existing[0]
+
+    url = uploaded_snapshots.get(content_hash)
+    if url is None and CATALOGUE_SNAPSHOTS_UPLOAD:
+        key = f"catalogue/{content_hash}.json.gz"
+        url = put_object(compressed, key, "application/gzip", "public, max-age=31536000, immutable")
+        if url:
+            uploaded_snapshots[content_hash] = url
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute(insert_sql, (content_hash, SNAPSHOT_FORMAT_VERSION, len(content), url, content.decode("utf-8")))
+            row = cur.fetchone()
+            if row is None:
+                # Another loader published the same content in the meantime
+                cur.execute("SELECT id FROM catalogue_snapshots WHERE content_hash = %s;", (content_hash,))
+                row = cur.fetchone()
+            else:
+                # Delivered when the transaction commits, so listeners never see a version they can't read yet
+                notification = json.dumps({"version": row[0], "contentHash": content_hash, "url": url})
+                cur.execute("SELECT pg_notify(%s, %s);", (CATALOGUE_NOTIFY_CHANNEL, notification))
+        conn.commit()
+    except psycopg2.Error as e:
+        logging.error(f"Database error while publishing the catalogue snapshot: {e}")
+        conn.rollback()
+        return None
+
+    logging.info(f"Published catalogue snapshot version {row[0]} ({len(content)} bytes, {len(compressed)} gzipped)")
+    metrics.incr("catalogue_snapshots_published")
+    return row[0]
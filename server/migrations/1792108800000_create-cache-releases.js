@@ -0,0 +1,32 @@
+/**
+ * @type {import('node-pg-migrate').ColumnDefinitions | undefined}
+ */
+exports.shorthands = undefined;
+
+/**
+ * @param pgm {import('node-pg-migrate').MigrationBuilder}
+ * @returns {Promise<void> | void}
+ */
+exports.up = (pgm) => {
+	// Releases of the osrs-cache the data loader has fully applied, so it can skip unchanged releases
+	pgm.createTable('cache_releases', {
+		id: 'id',
+		tag: {type: 'text', notNull: true},
+		asset_id: {type: 'bigint', notNull: true},
+		checksum: {type: 'text', notNull: true},
+		applied_at: {
+			type: 'TIMESTAMP WITHOUT TIME ZONE',
+			notNull: true,
+			default: pgm.func('CURRENT_TIMESTAMP'),
+		},
+	});
+	pgm.createIndex('cache_releases', 'applied_at');
+};
+
+/**
+ * @param pgm {import('node-pg-migrate').MigrationBuilder}
+ * @returns {Promise<void> | void}
+ */
+exports.down = (pgm) => {
+	pgm.dropTable('cache_releases');
+};
@@ -0,0 +1,26 @@
+/**
+ * @type {import('node-pg-migrate').ColumnDefinitions | undefined}
+ */
+exports.shorthands = undefined;
+
+/**
+ * @param pgm {import('node-pg-migrate').MigrationBuilder}
+ * @returns {Promise<void> | void}
+ */
+exports.up = (pgm) => {
+	// Hash of the subcategory's parsed items, set by the data loader to skip unchanged subcategories
+	pgm.addColumns('subcategories', {
+		content_digest: {
+			type: 'text',
+			notNull: false,
+		},
+	});
+};
+
+/**
+ * @param pgm {import('node-pg-migrate').MigrationBuilder}
+ * @returns {Promise<void> | void}
+ */
+exports.down = (pgm) => {
+	pgm.dropColumns('subcategories', ['content_digest']);
+};
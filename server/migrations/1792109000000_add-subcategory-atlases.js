@@ -0,0 +1,39 @@
+/**
+ * @type {import('node-pg-migrate').ColumnDefinitions | undefined}
+ */
+exports.shorthands = undefined;
+
+/**
+ * @param pgm {import('node-pg-migrate').MigrationBuilder}
+ * @returns {Promise<void> | void}
+ */
+exports.up = (pgm) => {
+	// Sprite atlas per subcategory, built by the data loader once every item has an image
+	pgm.addColumns('subcategories', {
+		atlas_png_url: {
+			type: 'text',
+			notNull: false,
+		},
+		atlas_webp_url: {
+			type: 'text',
+			notNull: false,
+		},
+		// { width, height, sprites: { [itemId]: [x, y, width, height] } }
+		atlas_map: {
+			type: 'jsonb',
+			notNull: false,
+		},
+		atlas_digest: {
+			type: 'text',
+			notNull: false,
+		},
+	});
+};
+
+/**
+ * @param pgm {import('node-pg-migrate').MigrationBuilder}
+ * @returns {Promise<void> | void}
+ */
+exports.down = (pgm) => {
+	pgm.dropColumns('subcategories', ['atlas_png_url', 'atlas_webp_url', 'atlas_map', 'atlas_digest']);
+};
@@ -0,0 +1,30 @@
+/**
+ * @type {import('node-pg-migrate').ColumnDefinitions | undefined}
+ */
+exports.shorthands = undefined;
+
+/**
+ * @param pgm {import('node-pg-migrate').MigrationBuilder}
+ * @returns {Promise<void> | void}
+ */
+exports.up = (pgm) => {
+	// Optimized variants of image_url, set by the data loader and backfill_images.py
+	pgm.addColumns('subcategory_items', {
+		image_webp_url: {
+			type: 'text',
+			notNull: false,
+		},
+		image_webp_2x_url: {
+			type: 'text',
+			notNull: false,
+		},
+	});
+};
+
+/**
+ * @param pgm {import('node-pg-migrate').MigrationBuilder}
+ * @returns {Promise<void> | void}
+ */
+exports.down = (pgm) => {
+	pgm.dropColumns('subcategory_items', ['image_webp_url', 'image_webp_2x_url']);
+};
@@ -0,0 +1,34 @@
+/**
+ * @type {import('node-pg-migrate').ColumnDefinitions | undefined}
+ */
+exports.shorthands = undefined;
+
+/**
+ * @param pgm {import('node-pg-migrate').MigrationBuilder}
+ * @returns {Promise<void> | void}
+ */
+exports.up = (pgm) => {
+	// Precomputed copies of the static catalogue, published by the data loader whenever it changes.
+	// The id is the snapshot version; the server loads the latest one and reloads on NOTIFY catalogue_snapshot.
+	pgm.createTable('catalogue_snapshots', {
+		id: 'id',
+		content_hash: {type: 'text', notNull: true, unique: true},
+		format_version: {type: 'integer', notNull: true},
+		size_bytes: {type: 'integer', notNull: true},
+		url: {type: 'text', notNull: false},
+		payload: {type: 'jsonb', notNull: true},
+		created_at: {
+			type: 'TIMESTAMP WITHOUT TIME ZONE',
+			notNull: true,
+			default: pgm.func('CURRENT_TIMESTAMP'),
+		},
+	});
+};
+
+/**
+ * @param pgm {import('node-pg-migrate').MigrationBuilder}
+ * @returns {Promise<void> | void}
+ */
+exports.down = (pgm) => {
+	pgm.dropTable('catalogue_snapshots');
+};
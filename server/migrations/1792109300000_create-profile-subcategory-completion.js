@@ -0,0 +1,55 @@
+/**
+ * @type {import('node-pg-migrate').ColumnDefinitions | undefined}
+ */
+exports.shorthands = undefined;
+
+/**
+ * @param pgm {import('node-pg-migrate').MigrationBuilder}
+ * @returns {Promise<void> | void}
+ */
+exports.up = (pgm) => {
+	// Owned/total item counts per profile and subcategory, so completion is read with an index lookup.
+	// The worker rewrites a profile's rows with its items; the data loader recomputes the rows of
+	// subcategories that gained or lost items. Profiles without any owned item in a subcategory have no row.
+	pgm.createTable('profile_subcategory_completion', {
+		profile_id: {
+			type: 'uuid',
+			notNull: true,
+			primaryKey: true,
+			references: 'profiles(id)',
+			onDelete: 'CASCADE',
+		},
+		subcategory_id: {
+			type: 'integer',
+			notNull: true,
+			primaryKey: true,
+			references: 'subcategories(id)',
+			onDelete: 'CASCADE',
+		},
+		owned_count: {type: 'integer', notNull: true},
+		total_count: {type: 'integer', notNull: true},
+		updated_at: {
+			type: 'TIMESTAMP WITHOUT TIME ZONE',
+			notNull: true,
+			default: pgm.func('CURRENT_TIMESTAMP'),
+		},
+	});
+	pgm.createIndex('profile_subcategory_completion', 'subcategory_id');
+
+	pgm.sql(`
+        INSERT INTO profile_subcategory_completion (profile_id, subcategory_id, owned_count, total_count)
+        SELECT pi.profile_id, si.subcategoryid, COUNT(*), s.total
+        FROM player_items pi
+                 JOIN subcategory_items si ON si.itemid = pi.itemid
+                 JOIN subcategories s ON s.id = si.subcategoryid
+        GROUP BY pi.profile_id, si.subcategoryid, s.total;
+	`);
+};
+
+/**
+ * @param pgm {import('node-pg-migrate').MigrationBuilder}
+ * @returns {Promise<void> | void}
+ */
+exports.down = (pgm) => {
+	pgm.dropTable('profile_subcategory_completion');
+};
@@ -0,0 +1,69 @@
+/**
+ * @type {import('node-pg-migrate').ColumnDefinitions | undefined}
+ */
+exports.shorthands = undefined;
+
+/**
+ * @param pgm {import('node-pg-migrate').MigrationBuilder}
+ * @returns {Promise<void> | void}
+ */
+exports.up = (pgm) => {
+	// One row per data loader run that changed the catalogue. The id is the catalogue version.
+	pgm.createTable('catalogue_versions', {
+		id: 'id',
+		release_tag: {type: 'text', notNull: false},
+		created_at: {
+			type: 'TIMESTAMP WITHOUT TIME ZONE',
+			notNull: true,
+			default: pgm.func('CURRENT_TIMESTAMP'),
+		},
+	});
+
+	// What each version changed. Rows carry the new values, so a client can apply them in id order.
+	// item_id is null for changes to the subcategory itself.
+	pgm.createTable('catalogue_changes', {
+		id: {type: 'bigserial', primaryKey: true},
+		version: {
+			type: 'integer',
+			notNull: true,
+			references: 'catalogue_versions(id)',
+			onDelete: 'CASCADE',
+		},
+		change: {
+			type: 'text',
+			notNull: true,
+			check: "change IN ('added', 'removed', 'renamed', 'reordered')",
+		},
+		subcategory_id: {type: 'integer', notNull: true},
+		item_id: {type: 'integer', notNull: false},
+		original_item_id: {type: 'integer', notNull: false},
+		name: {type: 'text', notNull: false},
+		category_id: {type: 'integer', notNull: false},
+		display_order: {type: 'integer', notNull: false},
+	});
+	pgm.createIndex('catalogue_changes', ['version', 'id']);
+
+	pgm.sql(`
+        CREATE FUNCTION catalogue_changes_since(since integer)
+            RETURNS SETOF catalogue_changes
+            LANGUAGE sql
+            STABLE
+        AS
+        $$
+        SELECT *
+        FROM catalogue_changes
+        WHERE version > since
+        ORDER BY version, id;
+        $$;
+	`);
+};
+
+/**
+ * @param pgm {import('node-pg-migrate').MigrationBuilder}
+ * @returns {Promise<void> | void}
+ */
+exports.down = (pgm) => {
+	pgm.sql('DROP FUNCTION IF EXISTS catalogue_changes_since(integer);');
+	pgm.dropTable('catalogue_changes');
+	pgm.dropTable('catalogue_versions');
+};
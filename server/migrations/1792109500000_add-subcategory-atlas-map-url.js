@@ -0,0 +1,32 @@
+/**
+ * @type {import('node-pg-migrate').ColumnDefinitions | undefined}
+ */
+exports.shorthands = undefined;
+
+/**
+ * @param pgm {import('node-pg-migrate').MigrationBuilder}
+ * @returns {Promise<void> | void}
+ */
+exports.up = (pgm) => {
+	// Uploaded copy of atlas_map, next to the atlas images
+	pgm.addColumns('subcategories', {
+		atlas_map_url: {
+			type: 'text',
+			notNull: false,
+		},
+	});
+	// Earlier atlases were saved even if their map failed to upload, have the data loader rebuild them all
+	pgm.sql(`
+        UPDATE subcategories
+        SET atlas_digest = NULL
+        WHERE atlas_digest IS NOT NULL;
+	`);
+};
+
+/**
+ * @param pgm {import('node-pg-migrate').MigrationBuilder}
+ * @returns {Promise<void> | void}
+ */
+exports.down = (pgm) => {
+	pgm.dropColumns('subcategories', ['atlas_map_url']);
+};
@@ -8,7 +8,9 @@ import {pinoHttp} from "pino-http";
 import {redisConnection} from "./queue";
 import {createGroupsRouter} from "./routes/groups";
 import {createUserRouter} from "./routes/users";
+import {createCatalogueRouter} from "./routes/catalogue";
 import {getKCLookupAliases} from "./utils/alias";
+import {startCatalogueListener} from "./utils/catalogue";
 
 dotenv.config();
 
@@ -56,6 +58,9 @@ pool.connect((err, client, release) => {
 	release();
 });
 
+// Serve the static catalogue from memory, reloading it whenever the data loader publishes a new snapshot
+const stopCatalogueListener = startCatalogueListener(pool);
+
 // Routes
 app.get('/', (req: Request, res: Response) => {
 	res.send('API is running...');
@@ -90,6 +95,7 @@ app.get('/kc-aliases', async (req, res): Promise<any> => {
 
 app.use('/groups', createGroupsRouter(pool));
 app.use('/users', createUserRouter(pool));
+app.use('/catalogue', createCatalogueRouter(pool));
 
 // Error handling middleware
 app.use((err: Error, req: Request, res: Response, next: NextFunction) => {
@@ -105,6 +111,7 @@ const server = app.listen(port, () => {
 const gracefulShutdown = async () => {
 	logger.info('Server shutting down gracefully...');
 	server.close();
+	stopCatalogueListener();
 	await redisConnection.quit();
 	await pool.end();
 	logger.info('Server shutdown complete.');
@@ -0,0 +1,82 @@
+﻿import {Router} from 'express';
+import {Pool} from 'pg';
+import {getCatalogue} from "../utils/catalogue";
+
+// Beyond this many rows a client is better off downloading the full catalogue again
+const MAX_CHANGES = 5000;
+
+export interface CatalogueChange {
+	version: number;
+	change: 'added' | 'removed' | 'renamed' | 'reordered';
+	subcategoryId: number;
+	itemId: number | null;
+	originalItemId: number | null;
+	name: string | null;
+	categoryId: number | null;
+	displayOrder: number | null;
+}
+
+export const createCatalogueRouter = (pool: Pool) => {
+	const router = Router();
+
+	router.get('/', async (req, res): Promise<any> => {
+		const catalogue = getCatalogue();
+		if (!catalogue) {
+			return res.status(503).json({error: 'The catalogue has not been published yet.'});
+		}
+		res.json({
+			catalogueVersion: catalogue.catalogueVersion,
+			contentHash: catalogue.contentHash,
+			categories: catalogue.categories,
+		});
+	});
+
+	router.get('/changes', async (req, res): Promise<any> => {
+		const log = req.log;
+		const since = Number(req.query.since);
+
+		if (!Number.isInteger(since) || since < 0) {
+			log.warn({since: req.query.since}, 'Invalid since parameter');
+			return res.status(400).json({error: "Invalid 'since' parameter. Must be a catalogue version (0 or more)."});
+		}
+
+		try {
+			const versionResult = await pool.query('SELECT COALESCE(MAX(id), 0) AS version FROM catalogue_versions;');
+			const version: number = versionResult.rows[0].version;
+			if (since >= version) {
+				return res.json({since, version, changes: []});
+			}
+
+			const changesResult = await pool.query(
+				`SELECT version, change, subcategory_id, item_id, original_item_id, name, category_id, display_order
+                 FROM catalogue_changes_since($1)
+                 WHERE version <= $2
+                 LIMIT $3;`,
+				[since, version, MAX_CHANGES + 1]
+			);
+			if (changesResult.rows.length > MAX_CHANGES) {
+				log.info({since, version}, 'Too many catalogue changes, client should refetch the catalogue');
+				return res.status(410).json({error: 'Too many changes since this version, fetch the full catalogue instead.', version});
+			}
+
+			const changes: CatalogueChange[] = changesResult.rows.map(row => ({
+				version: row.version,
+				change: row.change,
+				subcategoryId: row.subcategory_id,
+				itemId: row.item_id,
+				originalItemId: row.original_item_id,
+				name: row.name,
+				categoryId: row.category_id,
+				displayOrder: row.display_order,
+			}));
+			log.debug({since, version, changeCount: changes.length}, 'Catalogue changes fetched');
+
+			res.json({since, version, changes});
+		} catch (err) {
+			log.error(err, 'Error querying catalogue changes');
+			res.status(500).send('Server error');
+		}
+	});
+
+	return router;
+};
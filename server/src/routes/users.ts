@@ -1,9 +1,10 @@
 ﻿import {Router} from 'express';
-import {Pool} from 'pg';
+import {Pool, PoolClient} from 'pg';
 import {clogUpdateQueue, redisConnection} from "../queue";
 import {Job} from "bullmq";
 import {UserCollectionData} from "../models/UpdateCollectionLogRequest";
 import {getSubcategoryAlias} from "../utils/alias";
+import {CatalogueSnapshot, getCatalogue} from "../utils/catalogue";
 
 export interface Kc {
 	kc: number;
@@ -21,6 +22,47 @@ interface CollectionLogItemOutput {
 	quantity: number;
 }
 
+// Joins the profile's items and KC onto the in-memory catalogue, giving the same shape as the metadata query below
+const buildCategoriesFromCatalogue = async (client: PoolClient, catalogue: CatalogueSnapshot, profileId: string) => {
+	const ownedResult = await client.query(
+		`SELECT itemid, quantity
+         FROM player_items
+         WHERE profile_id = $1`,
+		[profileId]
+	);
+	const kcResult = await client.query(
+		`SELECT subcategoryid, MAX(kc) AS kc
+         FROM player_kc
+         WHERE profile_id = $1
+           AND kc != -1
+         GROUP BY subcategoryid`,
+		[profileId]
+	);
+	const owned = new Map<number, number>(ownedResult.rows.map(row => [row.itemid, row.quantity] as [number, number]));
+	const kcs = new Map<number, number>(kcResult.rows.map(row => [row.subcategoryid, row.kc] as [number, number]));
+
+	return catalogue.categories.map(category => ({
+		category_name: category.name,
+		subcategories: category.subcategories.map(subcategory => {
+			const items = subcategory.items.map(item => ({
+				item_id: item.originalItemId,
+				quantity: owned.get(item.itemId) || 0, // 0 for missing items
+				image_url: item.imageUrl,
+				item_name: item.name,
+				owned: owned.has(item.itemId),
+			}));
+			const ownedItems = items.filter(item => item.owned);
+			return {
+				name: subcategory.name,
+				// Owned items first, each group in catalogue order
+				items: [...ownedItems, ...items.filter(item => !item.owned)],
+				owned_items_count: ownedItems.length,
+				kc: kcs.get(subcategory.id) || 0,
+			};
+		}),
+	}));
+};
+
 export const createUserRouter = (pool: Pool) => {
 	const router = Router();
 
@@ -315,7 +357,6 @@ export const createUserRouter = (pool: Pool) => {
                                                 'owned', oi.itemid IS NOT NULL
                                         ) ORDER BY (oi.itemid IS NOT NULL) DESC, ai.id
                                 )                        AS items_json,
-                                COUNT(oi.itemid)         AS owned_items_count,
                                 COALESCE(MAX(pkc.kc), 0) AS kc -- Include player_kc.kc
                          FROM all_items ai
                                   LEFT JOIN owned_items oi ON ai.itemid = oi.itemid
@@ -323,19 +364,21 @@ export const createUserRouter = (pool: Pool) => {
                              AND pkc.profile_id = $1 AND pkc.kc != -1
                          GROUP BY ai.subcategoryid, ai.subcategory_name, ai.categoryid, ai.category_name),
                      subcategories_by_category AS (
-                         -- Step 4: Aggregate subcategories for each category
-                         SELECT categoryid,
-                                category_name,
+                         -- Step 4: Aggregate subcategories for each category, with completion read from the summary table
+                         SELECT ibs.categoryid,
+                                ibs.category_name,
                                 json_agg(
                                         json_build_object(
-                                                'name', subcategory_name,
-                                                'items', items_json,
-                                                'owned_items_count', owned_items_count,
-                                                'kc', kc -- Add kc to the subcategory
-                                        ) ORDER BY subcategory_name -- Consistent output order
+                                                'name', ibs.subcategory_name,
+                                                'items', ibs.items_json,
+                                                'owned_items_count', COALESCE(psc.owned_count, 0),
+                                                'kc', ibs.kc -- Add kc to the subcategory
+                                        ) ORDER BY ibs.subcategory_name -- Consistent output order
                                 ) AS subcategories_json
-                         FROM items_by_subcategory
-                         GROUP BY categoryid, category_name)
+                         FROM items_by_subcategory ibs
+                                  LEFT JOIN profile_subcategory_completion psc
+                                            ON psc.profile_id = $1 AND psc.subcategory_id = ibs.subcategoryid
+                         GROUP BY ibs.categoryid, ibs.category_name)
                 -- Step 5: Final aggregation of categories
                 SELECT json_agg(
                                json_build_object(
@@ -345,9 +388,17 @@ export const createUserRouter = (pool: Pool) => {
                        ) AS categories
                 FROM subcategories_by_category;
 			`;
-			const metadataResult = await client.query(metadataQuery, [profileId]);
+			// Only the player's rows need querying when the dumper has published a catalogue snapshot
+			const catalogue = getCatalogue();
+			let categories;
+			if (catalogue) {
+				categories = await buildCategoriesFromCatalogue(client, catalogue, profileId);
+			} else {
+				const metadataResult = await client.query(metadataQuery, [profileId]);
+				categories = metadataResult.rows.length > 0 ? metadataResult.rows[0].categories : null;
+			}
 
-			if (metadataResult.rows.length === 0 || !metadataResult.rows[0].categories) {
+			if (!categories || categories.length === 0) {
 				log.warn({username, gameMode}, 'No data found for the user.');
 				res.status(404).send('No data found for the user.');
 				return;
@@ -357,7 +408,7 @@ export const createUserRouter = (pool: Pool) => {
 				username: playerUsername,
 				gameMode,
 				availableGameModes,
-				categories: metadataResult.rows[0].categories,
+				categories,
 			};
 
 			res.json(response);
@@ -0,0 +1,127 @@
+﻿import {Pool, PoolClient} from 'pg';
+import logger from './logger';
+
+// Published by the data loader (dumper/snapshot.py) whenever the catalogue changes
+const CATALOGUE_CHANNEL = 'catalogue_snapshot';
+const SUPPORTED_FORMAT_VERSION = 1;
+const LISTEN_RETRY_MS = 5000;
+
+export interface CatalogueItem {
+	itemId: number;
+	originalItemId: number;
+	name: string;
+	imageUrl: string | null;
+	imageWebpUrl: string | null;
+	imageWebp2xUrl: string | null;
+}
+
+export interface CatalogueSubcategory {
+	id: number;
+	name: string;
+	// Sprite atlas of the items and its { width, height, sprites: { [itemId]: [x, y, width, height] } } map
+	atlasUrl: string | null;
+	atlasWebpUrl: string | null;
+	atlasMapUrl: string | null;
+	items: CatalogueItem[];
+}
+
+export interface CatalogueCategory {
+	id: number;
+	name: string;
+	subcategories: CatalogueSubcategory[];
+}
+
+export interface CatalogueSnapshot {
+	version: number;
+	// Latest catalogue_versions id included, clients fetch /catalogue/changes?since= from here
+	catalogueVersion: number;
+	contentHash: string;
+	categories: CatalogueCategory[];
+}
+
+let currentSnapshot: CatalogueSnapshot | null = null;
+
+// The latest catalogue snapshot, or null if none has been loaded yet
+export const getCatalogue = (): CatalogueSnapshot | null => currentSnapshot;
+
+export const loadLatestCatalogue = async (pool: Pool) => {
+	const result = await pool.query(
+		`SELECT id, content_hash, payload
+         FROM catalogue_snapshots
+         WHERE format_version = $1
+         ORDER BY id DESC
+         LIMIT 1`,
+		[SUPPORTED_FORMAT_VERSION]
+	);
+	if (result.rowCount === 0) {
+		logger.warn('No catalogue snapshot has been published yet, querying the catalogue per request');
+		return;
+	}
+
+	const row = result.rows[0];
+	if (currentSnapshot && currentSnapshot.version >= row.id) {
+		return;
+	}
+	// Replaced in one assignment, so requests already holding the old snapshot finish with it
+	currentSnapshot = {
+		version: row.id,
+		catalogueVersion: row.payload.catalogueVersion ?? 0,
+		contentHash: row.content_hash,
+		categories: row.payload.categories,
+	};
+	logger.info({version: row.id, contentHash: row.content_hash}, 'Loaded catalogue snapshot');
+};
+
+// Keeps a connection LISTENing for new snapshots. Returns a function that stops listening.
+export const startCatalogueListener = (pool: Pool) => {
+	let client: PoolClient | null = null;
+	let stopped = false;
+
+	const listen = async () => {
+		let failed = false;
+		const retry = (err: Error) => {
+			// A lost connection both emits 'error' and rejects the pending query, only retry once
+			if (failed) {
+				return;
+			}
+			failed = true;
+			logger.error(err, 'Catalogue listener failed, retrying');
+			if (client) {
+				client.release(err);
+				client = null;
+			}
+			if (!stopped) {
+				setTimeout(listen, LISTEN_RETRY_MS);
+			}
+		};
+
+		try {
+			client = await pool.connect();
+			client.on('notification', (msg) => {
+				if (msg.channel !== CATALOGUE_CHANNEL) {
+					return;
+				}
+				logger.info({payload: msg.payload}, 'Catalogue snapshot published');
+				loadLatestCatalogue(pool).catch((err) => logger.error(err, 'Failed to load catalogue snapshot'));
+			});
+			client.on('error', retry);
+			await client.query(`LISTEN ${CATALOGUE_CHANNEL}`);
+		} catch (err) {
+			retry(err as Error);
+			return;
+		}
+
+		// Only load once listening, so a snapshot published in between isn't missed
+		loadLatestCatalogue(pool).catch((err) => logger.error(err, 'Failed to load catalogue snapshot'));
+	};
+
+	listen();
+
+	return () => {
+		stopped = true;
+		if (client) {
+			client.release();
+			client = null;
+		}
+	};
+};
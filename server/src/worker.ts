@@ -145,6 +145,50 @@ const processClogUpdate = async (job: Job<UserCollectionData>) => {
 			log.info('No collected items provided in job data.');
 		}
 
+		// Rewrite the profile's completion summary from the items just stored. The data loader refreshes the
+		// same rows while merging the catalogue, so upsert instead of delete + insert, and lock the rows in
+		// subcategory order like it does: rows this profile no longer has are zeroed in order, then deleted.
+		log.debug(`Refreshing subcategory completion counts for profileId: ${profileId}`);
+		const completionUpsertQuery = `
+            WITH counts AS (
+                SELECT si.subcategoryid AS subcategory_id, COUNT(*) AS owned_count, s.total AS total_count
+                FROM player_items pi
+                         JOIN subcategory_items si ON si.itemid = pi.itemid
+                         JOIN subcategories s ON s.id = si.subcategoryid
+                WHERE pi.profile_id = $1
+                GROUP BY si.subcategoryid, s.total),
+                 existing AS (
+                     SELECT subcategory_id, total_count
+                     FROM profile_subcategory_completion
+                     WHERE profile_id = $1)
+            INSERT INTO profile_subcategory_completion (profile_id, subcategory_id, owned_count, total_count)
+            SELECT $1,
+                   COALESCE(counts.subcategory_id, existing.subcategory_id) AS subcategory_id,
+                   COALESCE(counts.owned_count, 0),
+                   COALESCE(counts.total_count, existing.total_count)
+            FROM counts
+                     FULL JOIN existing ON existing.subcategory_id = counts.subcategory_id
+            ORDER BY subcategory_id
+            ON CONFLICT (profile_id, subcategory_id)
+            DO UPDATE SET owned_count = EXCLUDED.owned_count,
+                          total_count = EXCLUDED.total_count,
+                          updated_at  = CURRENT_TIMESTAMP;
+		`;
+		await client.query(completionUpsertQuery, [profileId]);
+		// Also catches rows the loader committed after the upsert started, for subcategories the profile owns nothing in
+		const deleteCompletionQuery = `
+            DELETE
+            FROM profile_subcategory_completion c
+            WHERE c.profile_id = $1
+              AND NOT EXISTS (SELECT 1
+                              FROM player_items pi
+                                       JOIN subcategory_items si ON si.itemid = pi.itemid
+                              WHERE pi.profile_id = $1
+                                AND si.subcategoryid = c.subcategory_id);
+		`;
+		const completionResult = await client.query(deleteCompletionQuery, [profileId]);
+		log.debug(`Refreshed completion counts, ${completionResult.rowCount} subcategories no longer owned.`);
+
 		log.debug(`Deleting all existing subcategory KCs for profileId: ${profileId}`);
 		const deleteKcQuery = `
             DELETE